@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ClusterPoints
+                                 A QGIS plugin
+ Cluster Points conducts spatial clustering of points based on their mutual distance to each other. The user can select between the K-Means algorithm and (agglomerative) hierarchical clustering with several different link functions.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2020-03-30
+        copyright            : (C) 2020 by Johannes Jenkner
+        email                : jjenkner@web.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Johannes Jenkner'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+
+
+from .cluster_kernel import ellipsoid_parameters,model_labels
+
+from PyQt5.QtCore import QCoreApplication,QVariant
+
+from qgis.core import (QgsField,QgsDistanceArea,QgsFeatureRequest,
+                       QgsProcessingParameterVectorLayer,QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFile,QgsCoordinateTransform,
+                       QgsCoordinateReferenceSystem)
+
+from qgis.core import (QgsProcessing,QgsProcessingException,QgsProcessingAlgorithm,
+                      QgsProject)
+
+import json
+
+
+class ClusterAssignAlgorithm(QgsProcessingAlgorithm):
+    """
+    Assigns the points of a layer to the closest centroid of a cluster
+    model written by doCluster without refitting the clusters
+    """
+
+    Points = 'Points'
+    SelectedFeaturesOnly = 'SelectedFeaturesOnly'
+    Model = 'Model'
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.Points,
+            self.tr('Point layer'),
+            [QgsProcessing.TypeVectorPoint]))
+
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.SelectedFeaturesOnly,
+            self.tr('Flag for the use of selected features/points only')))
+
+        self.addParameter(QgsProcessingParameterFile(
+            self.Model,
+            self.tr('Cluster model file written by doCluster'),
+            extension='json'))
+
+    def processAlgorithm(self, parameters, context, progress):
+
+        vlayer = self.parameterAsVectorLayer(parameters, self.Points, context)
+        SelectedFeaturesOnly = self.parameterAsBool(parameters, self.SelectedFeaturesOnly, context)
+        Model = self.parameterAsFile(parameters, self.Model, context)
+
+        with open(Model) as f:
+            model = json.load(f)
+        for key in ("crs","ellipsoid","distance_type","percent_attrib","fields",
+                    "attr_centers","standard_factor","centroids"):
+            if key not in model:
+                raise QgsProcessingException("Model file lacks entry {}".format(key))
+        sRs = QgsCoordinateReferenceSystem.fromWkt(model["crs"])
+        fields = model["fields"]
+
+        # distances are measured in the CRS of the model
+        d = QgsDistanceArea()
+        d.setSourceCrs(sRs, context.transformContext())
+        d.setEllipsoid(model["ellipsoid"])
+        transform = QgsCoordinateTransform(vlayer.crs(),sRs,context.transformContext())
+
+        # copy layer
+        if SelectedFeaturesOnly:
+            vlayer_new = vlayer.materialize(QgsFeatureRequest().setFilterFids(vlayer.selectedFeatureIds()))
+        else:
+            vlayer.selectAll()
+            vlayer_new = vlayer.materialize(QgsFeatureRequest().setFilterFids(vlayer.selectedFeatureIds()))
+            vlayer.removeSelection()
+
+        # add copied layer to canvas
+        QgsProject.instance().addMapLayer(vlayer_new)
+
+        id_attr = [vlayer_new.fields().indexFromName(field) for field in fields]
+        for field,i in zip(fields,id_attr):
+            if i<0:
+                raise QgsProcessingException(
+                          "Field {} not found in input layer".format(field))
+
+        # collect coordinates and raw attribute values, skipping incomplete features
+        keys = []
+        xy = []
+        attributes = []
+        for infeat in vlayer_new.getFeatures():
+            values = [infeat[i] for i in id_attr]
+            if not all(v or v==0 for v in values):
+                continue
+            point = transform.transform(infeat.geometry().asPoint())
+            keys.append(infeat.id())
+            xy.append([point.x(),point.y()])
+            attributes.append([float(v) for v in values])
+        if len(keys)==0:
+            raise QgsProcessingException("No valid points available")
+        progress.pushInfo(self.tr("Assigning {} points to {} clusters".format( \
+                                  len(keys),len(model["centroids"]))))
+
+        # standardize attribute values and label all points as in the fitted model
+        labels = model_labels(model,keys,xy,attributes,*ellipsoid_parameters(d))
+
+        progress.pushInfo(self.tr("Writing output field Cluster_ID"))
+
+        # prepare output field in new layer
+        fieldList = vlayer_new.dataProvider().fields()
+        if "Cluster_ID" in [field.name() for field in fieldList]:
+            icl = fieldList.indexFromName("Cluster_ID")
+            vlayer_new.dataProvider().deleteAttributes([icl])
+        vlayer_new.dataProvider().addAttributes([QgsField("Cluster_ID",QVariant.Int)])
+        vlayer_new.updateFields()
+
+        # write output field in copied layer
+        fieldList = vlayer_new.dataProvider().fields()
+        icl = fieldList.indexFromName("Cluster_ID")
+        vlayer_new.dataProvider().changeAttributeValues(dict((key,{icl:int(label)}) \
+                                                        for key,label in zip(keys,labels)))
+
+        progress.setProgress(100)
+
+        return {self.Points:"Cluster_ID"}
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'assignCluster'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr(self.name())
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'clustering'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ClusterAssignAlgorithm()
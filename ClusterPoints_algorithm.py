@@ -33,29 +33,46 @@ __revision__ = '$Format:%H$'
 
 
 verbose = False
+number_oversampling_rounds = 5
+number_clara_samples = 5
+number_dense_medoid_points = 10000
+number_epsilon_samples = 1000
+number_timing_points = 200
 
 from .cf_blobs import CFTask
+from .cluster_kernel import (centroid_model,cluster_arrays,cluster_metrics,cluster_scores,
+                             connected_components,ellipsoid_parameters,fasterpam,parallel_map)
+from .cluster_hierarchy import (linkages,reducible,generic_linkage,nn_chain,graph_linkage,
+                                emst_linkage,emst_available,slink,pointer_linkage,
+                                linkage_pointer,cut_tree,parse_cluster_numbers,square_file)
 
 from qgis.core import QgsProcessingAlgorithm,QgsApplication,QgsProcessingProvider
 
 from PyQt5.QtCore import QCoreApplication,QVariant
 
-from qgis.core import (QgsField,QgsPoint,QgsPointXY,QgsDistanceArea,
+from qgis.core import (QgsField,QgsFields,QgsPoint,QgsPointXY,QgsDistanceArea,
                        QgsProcessingParameterVectorLayer,QgsProcessingParameterBoolean,
                        QgsProcessingParameterEnum,QgsProcessingParameterNumber,
-                       QgsProcessingParameterField,QgsVectorLayer,QgsFeature,
-                       QgsFeatureRequest,QgsGeometry)
+                       QgsProcessingParameterField,QgsProcessingParameterFile,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterFileDestination,QgsVectorLayer,QgsFeature,
+                       QgsProcessingParameterFeatureSink,QgsFeatureSink,QgsWkbTypes,
+                       QgsProcessingOutputNumber,QgsProcessingOutputString,
+                       QgsFeatureRequest,QgsGeometry,QgsCoordinateTransform,
+                       QgsCoordinateReferenceSystem)
 
 from qgis.core import (QgsProcessing,QgsProcessingException,QgsProcessingAlgorithm,
                       Qgis,QgsTask,QgsMessageLog,QgsProject)
 
 from math import fsum,sqrt
 from sys import float_info
-from bisect import bisect
-from time import sleep
+from time import sleep,time
 
-from numpy import argmax
+import numpy as np
 
+from os import remove
+
+import json
 import random
 
 MESSAGE_CATEGORY = 'ClusterPoints: Clustering'
@@ -83,13 +100,44 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
     SelectedFeaturesOnly = 'SelectedFeaturesOnly'
     Cluster_Type = 'Cluster_Type'
     RandomSeed = 'RandomSeed'
+    Initialization = 'Initialization'
+    NumberOfRestarts = 'NumberOfRestarts'
+    MaxIterations = 'MaxIterations'
+    RelativeTolerance = 'RelativeTolerance'
+    LabelChangeFraction = 'LabelChangeFraction'
+    CoresetSize = 'CoresetSize'
+    FuzzyNeighbours = 'FuzzyNeighbours'
+    SplitCriterion = 'SplitCriterion'
+    MedoidSampleSize = 'MedoidSampleSize'
+    Epsilon = 'Epsilon'
+    MinPoints = 'MinPoints'
+    InitialCentroids = 'InitialCentroids'
+    InitialModel = 'InitialModel'
+    OutputModel = 'OutputModel'
     Linkage = 'Linkage'
     Fuzzifier = 'Fuzzifier'
     Distance_Type = 'Distance_Type'
     NumberOfClusters = 'NumberOfClusters'
+    ClusterNumbers = 'ClusterNumbers'
+    OutputDendrogram = 'OutputDendrogram'
+    InitialDendrogram = 'InitialDendrogram'
+    MaxNumberOfClusters = 'MaxNumberOfClusters'
+    SelectionCriterion = 'SelectionCriterion'
+    SelectionTable = 'SelectionTable'
+    SilhouetteSampleSize = 'SilhouetteSampleSize'
+    TimeBudget = 'TimeBudget'
+    ClusterSizes = 'ClusterSizes'
+    ClusterInertia = 'ClusterInertia'
+    CalinskiHarabasz = 'CalinskiHarabasz'
+    DaviesBouldin = 'DaviesBouldin'
+    SimplifiedSilhouette = 'SimplifiedSilhouette'
+    Silhouette = 'Silhouette'
     AggregationPercentile = 'AggregationPercentile'
+    ScratchFolder = 'ScratchFolder'
+    ConnectivityNeighbours = 'ConnectivityNeighbours'
     PercentAttrib = 'PercentAttrib'
     AttribValues = 'AttribValues'
+    WeightField = 'WeightField'
 
     def initAlgorithm(self, config):
         """
@@ -107,14 +155,52 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
 
         self.addParameter(QgsProcessingParameterEnum(
             self.Cluster_Type,
-            self.tr("Cluster algorithm (K-Means, Fuzzy C-Means or Hierarchical)"),
-            ['K-Means','Fuzzy C-Means','Hierarchical'],defaultValue='K-Means'))
+            self.tr("Cluster algorithm (K-Means, Fuzzy C-Means, Hierarchical, "+ \
+                    "Bisecting K-Means, K-Medoids or DBSCAN)"),
+            ['K-Means','Fuzzy C-Means','Hierarchical','Bisecting K-Means',
+            'K-Medoids (FasterPAM)','DBSCAN'],defaultValue='K-Means'))
   
         self.addParameter(QgsProcessingParameterNumber(
             self.RandomSeed,
             self.tr('RandomSeed for initialization'),
             defaultValue=1,minValue=1,maxValue=999))
 
+        self.addParameter(QgsProcessingParameterEnum(
+            self.Initialization,
+            self.tr("Initialization of K-Means or Fuzzy C-Means"),
+            ['K-Means++','K-Means|| (parallel oversampling)'],defaultValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.NumberOfRestarts,
+            self.tr('Number of parallel runs with different seeds keeping the best fit '+ \
+                    '(only used for K-Means and Fuzzy C-Means)'),
+            defaultValue=1,minValue=1,maxValue=100))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.MaxIterations,
+            self.tr('Maximum number of iterations (only used for K-Means and Fuzzy C-Means)'),
+            defaultValue=300,minValue=1))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.RelativeTolerance,
+            self.tr('Relative change of objective function to stop iterations '+ \
+                    '(0 for no limit)'),
+            type = QgsProcessingParameterNumber.Double,
+            defaultValue=0,minValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.LabelChangeFraction,
+            self.tr('Fraction of points changing clusters to stop iterations '+ \
+                    '(0 for no limit)'),
+            type = QgsProcessingParameterNumber.Double,
+            defaultValue=0,minValue=0,maxValue=1))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.CoresetSize,
+            self.tr('Size of weighted coreset clustered instead of all points '+ \
+                    '(0 for all points, only used for K-Means and Fuzzy C-Means)'),
+            defaultValue=0,minValue=0))
+
         self.addParameter(QgsProcessingParameterEnum(
             self.Linkage,
             self.tr("Link functions for Hierarchical algorithm"),
@@ -134,17 +220,99 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
             self.tr('User-defined number of clusters'),
             defaultValue=2,minValue=2,maxValue=999))
 
+        self.addParameter(QgsProcessingParameterString(
+            self.ClusterNumbers,
+            self.tr('Comma-separated numbers of clusters for additional cuts of the '+ \
+                    'cluster tree written to fields Cluster_ID_k (only used for Hierarchical '+ \
+                    'and Bisecting K-Means)'),
+            optional=True))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.MaxNumberOfClusters,
+            self.tr('Maximum number of clusters for an automatic selection starting '+ \
+                    'from the user-defined number (0 for no selection, not used for '+ \
+                    'Hierarchical and DBSCAN)'),
+            defaultValue=0,minValue=0,maxValue=999))
+
+        self.addParameter(QgsProcessingParameterEnum(
+            self.SelectionCriterion,
+            self.tr("Criterion for the automatic selection of the number of clusters"),
+            ['Elbow of the sum of squared errors','Calinski-Harabasz index',
+            'Simplified silhouette'],defaultValue=1))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SilhouetteSampleSize,
+            self.tr('Number of sampled points for the exact silhouette '+ \
+                    '(0 for no exact silhouette)'),
+            defaultValue=1000,minValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TimeBudget,
+            self.tr('Time budget in seconds after which iterations stop with '+ \
+                    'the current state (0 for no limit, hierarchical clustering is refused '+ \
+                    'if estimated to take longer, DBSCAN is not limited)'),
+            type = QgsProcessingParameterNumber.Double,
+            defaultValue=0,minValue=0))
+
         self.addParameter(QgsProcessingParameterNumber(
             self.Fuzzifier,
             self.tr('Fuzzifier coefficient m (only used for Fuzzy C-Means)'),
             type = QgsProcessingParameterNumber.Double,
             defaultValue=2.0,minValue=1.1))
 
+        self.addParameter(QgsProcessingParameterNumber(
+            self.FuzzyNeighbours,
+            self.tr('Number of nearest clusters with memberships per point '+ \
+                    '(0 for all clusters, only used for Fuzzy C-Means)'),
+            defaultValue=0,minValue=0,maxValue=999))
+
+        self.addParameter(QgsProcessingParameterEnum(
+            self.SplitCriterion,
+            self.tr("Cluster to split next (only used for Bisecting K-Means)"),
+            ['Highest sum of squared errors','Largest number of points'],defaultValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.MedoidSampleSize,
+            self.tr('Sample size for CLARA-style sampling (0 for all points up to '+ \
+                    '{} points, samples of this size otherwise, '.format(number_dense_medoid_points)+ \
+                    'only used for K-Medoids)'),
+            defaultValue=0,minValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.Epsilon,
+            self.tr('Neighbourhood radius epsilon '+ \
+                    '(0 for an estimate, only used for DBSCAN)'),
+            type = QgsProcessingParameterNumber.Double,
+            defaultValue=0,minValue=0))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.MinPoints,
+            self.tr('Minimum number (or weight) of points in the neighbourhood '+ \
+                    'of core points (only used for DBSCAN)'),
+            defaultValue=5,minValue=1))
+
         self.addParameter(QgsProcessingParameterNumber(
             self.AggregationPercentile,
-            self.tr('Cluster feature distance percentile (only used for Lance-Williams)'),
+            self.tr('Cluster feature distance percentile (only used for Lance-Williams '+ \
+                    'except planar single linkage without attributes, '+ \
+                    'cluster features are weighted by their numbers of points)'),
             defaultValue=5,minValue=0,maxValue=99))
 
+        self.addParameter(QgsProcessingParameterFile(
+            self.ScratchFolder,
+            self.tr('Scratch folder for a memory-mapped distance matrix exceeding the '+ \
+                    'memory (only used for Lance-Williams, empty to keep it in memory, '+ \
+                    'needs 8*n*n bytes of disk space and is slow unless mostly cached, '+ \
+                    'as every merge also rewrites one strided column)'),
+            behavior=QgsProcessingParameterFile.Folder,optional=True))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.ConnectivityNeighbours,
+            self.tr('Number of nearest neighbours in the connectivity graph restricting '+ \
+                    'merges to adjacent clusters (0 for no restriction, only used for '+ \
+                    'Lance-Williams)'),
+            defaultValue=0,minValue=0))
+
         self.addParameter(QgsProcessingParameterNumber(
             self.PercentAttrib,self.tr('Percentage contribution of attribute fields'),
             defaultValue=50,minValue=0,maxValue=100))
@@ -154,24 +322,139 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
             self.Points,type=QgsProcessingParameterField.Numeric,
             allowMultiple=True,optional=True))
 
+        self.addParameter(QgsProcessingParameterField(
+            self.WeightField,self.tr('Weight field (e.g. number of households per point)'),'',
+            self.Points,type=QgsProcessingParameterField.Numeric,optional=True))
+
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.InitialCentroids,
+            self.tr('Point layer with initial centroids (only used for K-Means and Fuzzy C-Means)'),
+            [QgsProcessing.TypeVectorPoint],optional=True))
+
+        self.addParameter(QgsProcessingParameterFile(
+            self.InitialModel,
+            self.tr('Centroid file of an earlier run for initialization '+ \
+                    '(only used for K-Means and Fuzzy C-Means)'),
+            extension='json',optional=True))
+
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OutputModel,
+            self.tr('Output model file with final centroids for warm starts and '+ \
+                    'assignCluster (not used for Hierarchical)'),
+            self.tr('JSON files (*.json)'),optional=True,createByDefault=False))
+
+        self.addParameter(QgsProcessingParameterFile(
+            self.InitialDendrogram,
+            self.tr('Dendrogram file of an earlier run into which only new features '+ \
+                    'are inserted (only used for Single (SLINK))'),
+            extension='json',optional=True))
+
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OutputDendrogram,
+            self.tr('Output dendrogram file with the full merge table for recutDendrogram '+ \
+                    '(only used for Hierarchical)'),
+            self.tr('JSON files (*.json)'),optional=True,createByDefault=False))
+
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.SelectionTable,
+            self.tr('Scores per number of clusters of the automatic selection'),
+            QgsProcessing.TypeVector,optional=True,createByDefault=False))
+
+        self.addOutput(QgsProcessingOutputString(
+            self.ClusterSizes,self.tr('Number (or weight) of points per cluster')))
+        self.addOutput(QgsProcessingOutputString(
+            self.ClusterInertia,self.tr('Sum of squared errors per cluster')))
+        self.addOutput(QgsProcessingOutputNumber(
+            self.CalinskiHarabasz,self.tr('Calinski-Harabasz index')))
+        self.addOutput(QgsProcessingOutputNumber(
+            self.DaviesBouldin,self.tr('Davies-Bouldin index')))
+        self.addOutput(QgsProcessingOutputNumber(
+            self.SimplifiedSilhouette,self.tr('Simplified silhouette')))
+        self.addOutput(QgsProcessingOutputNumber(
+            self.Silhouette,self.tr('Silhouette of sampled points')))
+
     def processAlgorithm(self, parameters, context, progress):
 
         vlayer = self.parameterAsVectorLayer(parameters, self.Points, context)
         SelectedFeaturesOnly = self.parameterAsBool(parameters, self.SelectedFeaturesOnly, context)
         Cluster_Type = self.parameterAsEnum(parameters, self.Cluster_Type, context)
         RandomSeed = self.parameterAsInt(parameters, self.RandomSeed, context)
+        Initialization = self.parameterAsEnum(parameters, self.Initialization, context)
+        NumberOfRestarts = self.parameterAsInt(parameters, self.NumberOfRestarts, context)
+        MaxIterations = self.parameterAsInt(parameters, self.MaxIterations, context)
+        RelativeTolerance = self.parameterAsDouble(parameters, self.RelativeTolerance, context)
+        LabelChangeFraction = self.parameterAsDouble(parameters, self.LabelChangeFraction, context)
+        CoresetSize = self.parameterAsInt(parameters, self.CoresetSize, context)
         Linkage = self.parameterAsEnum(parameters, self.Linkage, context)
         Fuzzifier = self.parameterAsDouble(parameters, self.Fuzzifier, context)
+        FuzzyNeighbours = self.parameterAsInt(parameters, self.FuzzyNeighbours, context)
+        SplitCriterion = self.parameterAsEnum(parameters, self.SplitCriterion, context)
+        MedoidSampleSize = self.parameterAsInt(parameters, self.MedoidSampleSize, context)
+        Epsilon = self.parameterAsDouble(parameters, self.Epsilon, context)
+        MinPoints = self.parameterAsInt(parameters, self.MinPoints, context)
         Distance_Type = self.parameterAsEnum(parameters, self.Distance_Type, context)
         NumberOfClusters = self.parameterAsInt(parameters, self.NumberOfClusters, context)
+        ClusterNumbers = self.parameterAsString(parameters, self.ClusterNumbers, context)
+        MaxNumberOfClusters = self.parameterAsInt(parameters, self.MaxNumberOfClusters, context)
+        SelectionCriterion = self.parameterAsEnum(parameters, self.SelectionCriterion, context)
+        SilhouetteSampleSize = self.parameterAsInt(parameters, self.SilhouetteSampleSize, context)
+        TimeBudget = self.parameterAsDouble(parameters, self.TimeBudget, context)
         AggregationPercentile = self.parameterAsInt(parameters, self.AggregationPercentile, context)
+        ScratchFolder = self.parameterAsFile(parameters, self.ScratchFolder, context)
+        ConnectivityNeighbours = self.parameterAsInt(parameters, self.ConnectivityNeighbours, context)
         PercentAttrib = self.parameterAsInt(parameters, self.PercentAttrib, context)
         AttribValues = self.parameterAsFields(parameters, self.AttribValues, context)
+        WeightField = self.parameterAsString(parameters, self.WeightField, context)
+        InitialCentroids = self.parameterAsVectorLayer(parameters, self.InitialCentroids, context)
+        InitialModel = self.parameterAsFile(parameters, self.InitialModel, context)
+        OutputModel = self.parameterAsFileOutput(parameters, self.OutputModel, context)
+        OutputDendrogram = self.parameterAsFileOutput(parameters, self.OutputDendrogram, context)
+        InitialDendrogram = self.parameterAsFile(parameters, self.InitialDendrogram, context)
 
         links = ["single", "single", "complete", "median", "average", "wards", "centroid"]
+        inits = ["k-means++", "k-means||"]
+        selections = ["elbow", "calinski-harabasz", "silhouette"]
+
+        # range of cluster numbers for an automatic selection
+        if MaxNumberOfClusters>NumberOfClusters and Cluster_Type in (0,1,3,4):
+            k_range = list(range(NumberOfClusters,MaxNumberOfClusters+1))
+        else:
+            k_range = None
+
+        # additional cuts of the cluster tree
+        try:
+            cuts = parse_cluster_numbers(ClusterNumbers or "")
+        except ValueError:
+            raise QgsProcessingException("Invalid list of numbers of clusters: "+ \
+                                         "{}".format(ClusterNumbers))
+        if Cluster_Type not in (2,3):
+            if cuts:
+                progress.pushInfo(self.tr("Additional numbers of clusters only used "+ \
+                                          "for Hierarchical and Bisecting K-Means"))
+            cuts = []
+
+        # pointer representation of an earlier SLINK run to be extended
+        tree = None
+        if InitialDendrogram:
+            if Cluster_Type!=2 or Linkage!=0:
+                progress.pushInfo(self.tr("Initial dendrogram only used for Single (SLINK)"))
+            else:
+                with open(InitialDendrogram) as f:
+                    tree = json.load(f)
+                for key in ("leaves","pi","lambda","distance_type","percent_attrib",
+                            "fields","attr_centers","standard_factor"):
+                    if key not in tree:
+                        raise QgsProcessingException("Dendrogram file lacks entry "+ \
+                                                     "{} of a SLINK run".format(key))
+                if not len(tree["pi"])==len(tree["lambda"])==len(tree["leaves"]):
+                    raise QgsProcessingException("Pointer representation does not match "+ \
+                                                 "the features of the dendrogram file")
 
         random.seed(RandomSeed)
 
+        # wall-clock deadline of the clustering
+        deadline = time()+TimeBudget if TimeBudget>0 else None
+
         if vlayer.dataProvider().featureCount()<NumberOfClusters:
             raise QgsProcessingException("Error initializing cluster analysis:\nToo little features available")
         sRs = vlayer.dataProvider().crs()
@@ -223,12 +506,55 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
                         del points[infeat.id()]
                         break
 
+        # retrieve optional point weights
+        if WeightField:
+            if SelectedFeaturesOnly:
+                fit = vlayer.getSelectedFeatures()
+            else:
+                fit = vlayer.getFeatures()
+            id_weight = vlayer.dataProvider().fieldNameIndex(WeightField)
+            if id_weight<0:
+                raise QgsProcessingException(
+                          "Field {} not found in input layer".format(WeightField))
+            for infeat in fit:
+                if infeat.id() not in points:
+                    continue
+                if not infeat[id_weight]:
+                    # points with missing or zero weight do not contribute
+                    del points[infeat.id()]
+                elif infeat[id_weight]<0:
+                    raise QgsProcessingException("Weight of feature {} ".format( \
+                                                 infeat.id())+"must not be negative")
+                else:
+                    points[infeat.id()].setWeight(float(infeat[id_weight]))
+
         if NumberOfClusters>len(points):
             raise QgsProcessingException("Too little valid points "+ \
                                     "available for {} clusters".format(NumberOfClusters))
+        if k_range is not None and k_range[-1]>len(points):
+            raise QgsProcessingException("Too little valid points "+ \
+                                    "available for {} clusters".format(k_range[-1]))
+        if cuts and cuts[-1]>len(points):
+            raise QgsProcessingException("Too little valid points "+ \
+                                    "available for {} clusters".format(cuts[-1]))
+
+        # distances must be defined as in the earlier run
+        if tree is not None:
+            if tree["percent_attrib"]!=PercentAttrib or \
+               tree["distance_type"]!=["Euclidean","Manhattan"][Distance_Type] or \
+               tree["fields"]!=(list(AttribValues) if PercentAttrib>0 else []):
+                raise QgsProcessingException("Distance type, attribute fields and their "+ \
+                                             "contribution must match the initial dendrogram")
 
         # standardize z values with standard deviation of horizontal distances
-        if PercentAttrib>0:
+        if PercentAttrib>0 and tree is not None:
+            # keep the standardization of the earlier run
+            attr_centers = tree["attr_centers"]
+            standard_factor = tree["standard_factor"]
+            for key in points.keys():
+                points[key].replaceAttributes([(points[key].attributes[j]-attr_centers[j]) \
+                                              *standard_factor for j in range(len(AttribValues))])
+        elif PercentAttrib>0:
             for j in range(len(AttribValues)):
                 if len(set([p.attributes[j] for p in points.values()]))==1:
                     raise QgsProcessingException("Field {} must not be constant".format(AttribValues[j])) 
@@ -240,6 +566,33 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
             for key in points.keys():
                 points[key].replaceAttributes([(points[key].attributes[j]-attr_centers[j]) \
                                               *standard_factor for j in range(len(AttribValues))])
+        else:
+            AttribValues = []
+            standard_factor = 1.0
+            attr_centers = []
+
+        # retrieve optional initial centroids for a warm start
+        initial = None
+        if Cluster_Type<2 and (InitialCentroids is not None or InitialModel):
+            if InitialCentroids is not None:
+                progress.pushInfo(self.tr("Initializing centroids from layer {}".format( \
+                                          InitialCentroids.name())))
+                centroids = self.read_centroid_layer(InitialCentroids,AttribValues,sRs,context)
+            else:
+                progress.pushInfo(self.tr("Initializing centroids from file {}".format( \
+                                          InitialModel)))
+                centroids = self.read_centroid_file(InitialModel,AttribValues,sRs,context)
+            if k_range is not None:
+                raise QgsProcessingException("Initial centroids cannot be combined "+ \
+                                             "with an automatic selection of the "+ \
+                                             "number of clusters")
+            if len(centroids)!=NumberOfClusters:
+                raise QgsProcessingException("Number of initial centroids ({}) ".format( \
+                                             len(centroids))+"must match the number "+ \
+                                             "of clusters ({})".format(NumberOfClusters))
+            initial = ([c[:2] for c in centroids], \
+                       [[(c[2+j]-attr_centers[j])*standard_factor \
+                       for j in range(len(AttribValues))] for c in centroids])
 
         # define the clustering procedure
         if Cluster_Type==0:
@@ -251,7 +604,12 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
                                       "with {} points ...".format(len(points))))      
             task = ClusterTask("K-Means clustering", \
                                None,points,PercentAttrib, \
-                               NumberOfClusters,d,Distance_Type==1)
+                               NumberOfClusters,d,Distance_Type==1, \
+                               init=inits[Initialization],n_init=NumberOfRestarts, \
+                               seed=RandomSeed,max_iter=MaxIterations, \
+                               tol=RelativeTolerance,label_fraction=LabelChangeFraction, \
+                               coreset_size=CoresetSize,initial=initial, \
+                               k_range=k_range,selection=selections[SelectionCriterion])
         
         elif Cluster_Type==1:
         
@@ -262,7 +620,55 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
                                       "with {} points ...".format(len(points))))      
             task = ClusterTask("Fuzzy C-Means clustering", \
                                None,points,PercentAttrib, \
-                               NumberOfClusters,d,Distance_Type==1,Fuzzifier)
+                               NumberOfClusters,d,Distance_Type==1,Fuzzifier, \
+                               init=inits[Initialization],n_init=NumberOfRestarts, \
+                               seed=RandomSeed,max_iter=MaxIterations, \
+                               tol=RelativeTolerance,label_fraction=LabelChangeFraction, \
+                               coreset_size=CoresetSize,initial=initial, \
+                               neighbours=FuzzyNeighbours, \
+                               k_range=k_range,selection=selections[SelectionCriterion])
+
+        elif Cluster_Type==3:
+
+            if parameters['Linkage'] is not None:
+                progress.pushInfo(self.tr("Linkage not used for Bisecting K-Means"))
+            # Bisecting K-means clustering
+            progress.pushInfo(self.tr("Processing Bisecting K-Means clustering "+
+                                      "with {} points ...".format(len(points))))
+            task = ClusterTask("Bisecting K-Means clustering", \
+                               None,points,PercentAttrib, \
+                               NumberOfClusters,d,Distance_Type==1, \
+                               init=inits[Initialization],n_init=NumberOfRestarts, \
+                               seed=RandomSeed,max_iter=MaxIterations, \
+                               tol=RelativeTolerance,label_fraction=LabelChangeFraction, \
+                               split=["sse","size"][SplitCriterion], \
+                               k_range=k_range,selection=selections[SelectionCriterion])
+
+        elif Cluster_Type==4:
+
+            if parameters['Linkage'] is not None:
+                progress.pushInfo(self.tr("Linkage not used for K-Medoids"))
+            # K-medoids clustering
+            progress.pushInfo(self.tr("Processing K-Medoids clustering "+
+                                      "with {} points ...".format(len(points))))
+            task = ClusterTask("K-Medoids clustering", \
+                               None,points,PercentAttrib, \
+                               NumberOfClusters,d,Distance_Type==1, \
+                               seed=RandomSeed,max_iter=MaxIterations, \
+                               sample_size=MedoidSampleSize, \
+                               k_range=k_range,selection=selections[SelectionCriterion])
+
+        elif Cluster_Type==5:
+
+            if parameters['Linkage'] is not None:
+                progress.pushInfo(self.tr("Linkage not used for DBSCAN"))
+            # DBSCAN clustering
+            progress.pushInfo(self.tr("Processing DBSCAN clustering "+
+                                      "with {} points ...".format(len(points))))
+            task = ClusterTask("DBSCAN clustering", \
+                               None,points,PercentAttrib, \
+                               NumberOfClusters,d,Distance_Type==1, \
+                               seed=RandomSeed,eps=Epsilon,min_points=MinPoints)
                 
         else:
         
@@ -274,15 +680,42 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
             progress.pushInfo(self.tr("Processing hierarchical clustering "+
                                       "with {} points ...".format(len(points))))      
             if Linkage==0:
+                if tree is not None:
+                    # points of the earlier run come first in their former order
+                    known = [leaf[0] for leaf in tree["leaves"]]
+                    for key in known:
+                        if key not in points:
+                            raise QgsProcessingException("Feature {} of the ".format(key)+ \
+                                "initial dendrogram is no longer available")
+                    known_set = set(known)
+                    points = dict([(key,points[key]) for key in known]+ \
+                                  [(key,p) for key,p in points.items() if key not in known_set])
+                    progress.pushInfo(self.tr("Inserting {} new points into the ".format( \
+                                              len(points)-len(known))+ \
+                                              "dendrogram of {} points".format(len(known))))
                 task = ClusterTask("Hierarchical clustering using SLINK", \
                                    links[Linkage],points,PercentAttrib, \
                                    NumberOfClusters,d,Distance_Type==1)             
+                if tree is not None:
+                    task.pointer = (np.array(tree["pi"],dtype=np.intp),
+                                    np.array([np.inf if height is None else height \
+                                              for height in tree["lambda"]],dtype=float))
             else:
+                task = ClusterTask("Hierarchical clustering using "+ \
+                                   "Lance-Williams distance updates", \
+                                   links[Linkage],points,PercentAttrib, \
+                                   NumberOfClusters,d,Distance_Type==1)
+                task.connectivity = ConnectivityNeighbours
+                if AggregationPercentile>0 and task.aggregation(AggregationPercentile)==0:
+                    progress.pushInfo(self.tr("Cluster features not used for single linkage "+ \
+                                              "from the Euclidean minimum spanning tree"))
+                    AggregationPercentile = 0
                 if AggregationPercentile>0:
                     task_add = CFTask("BIRCH-like preprocessing", points,
                                             AggregationPercentile, d=d,
                                             pa=PercentAttrib,
-                                            manhattan=(Distance_Type==1))
+                                            manhattan=(Distance_Type==1),
+                                            deadline=deadline)
                     
                     # run potentially expensive preparation in extra task
                     QgsApplication.taskManager().addTask(task_add)
@@ -301,19 +734,37 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
                         cf_data = {}
                     else:
                         cf_data = task_add.return_centroids()
-                        if NumberOfClusters>len(cf_data):
+                        if max([NumberOfClusters]+cuts)>len(cf_data):
                              raise QgsProcessingException("Too little valid cluster features "+ \
-                                 "available for {} clusters".format(NumberOfClusters))
+                                 "available for {} clusters".format(max([NumberOfClusters]+cuts)))
 
                     progress.pushInfo(self.tr("Processing hierarchical clustering "+
-                                      "with {} cluster features ...".format(len(cf_data))))                    
-                else:
-                     cf_data = points
-                task = ClusterTask("Hierarchical clustering using "+ \
-                                   "Lance-Williams distance updates", \
-                                   links[Linkage],cf_data,PercentAttrib, \
-                                   NumberOfClusters,d,Distance_Type==1)
+                                      "with {} cluster features ...".format(len(cf_data))))
+                    progress.pushInfo(self.tr("Cluster features are weighted by "+
+                                      "their numbers of points (or summed point weights)"))
+                    task = ClusterTask("Hierarchical clustering using "+ \
+                                       "Lance-Williams distance updates", \
+                                       links[Linkage],cf_data,PercentAttrib, \
+                                       NumberOfClusters,d,Distance_Type==1)
         
+        task.silhouette_sample = SilhouetteSampleSize
+        task.deadline = deadline
+        task.scratch = ScratchFolder or None
+        task.cuts = cuts
+        if "Lance-Williams" in task.description():
+            task.connectivity = ConnectivityNeighbours
+
+        # refuse hierarchical clustering which cannot finish within the time budget
+        if deadline is not None and task.description().startswith("Hierarchical") and \
+           task.pointer is None:
+            estimate = task.estimate_runtime()
+            if estimate > deadline-time():
+                raise QgsProcessingException("Hierarchical clustering of "+ \
+                    "{} points is estimated to take {:.0f} s, ".format(len(task.points),estimate)+ \
+                    "exceeding the remaining time budget of {:.0f} s".format(deadline-time()))
+            progress.pushInfo(self.tr("Hierarchical clustering estimated to take "+ \
+                                      "{:.0f} s".format(estimate)))
+
         # run potentially expensive clustering in extra task
         QgsApplication.taskManager().addTask(task)
         
@@ -327,8 +778,104 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
         # work-around for QGIS bug of task method "run" not finishing 
         task.finished(task.result)
 
+        # report objective values of individual runs
+        if len(task.objectives)>1:
+            for run,objective in enumerate(task.objectives):
+                if objective is None:
+                    progress.pushInfo(self.tr("Run {}: failed".format(run+1)))
+                else:
+                    progress.pushInfo(self.tr("Run {}: {:.5E} ({})".format(run+1,
+                                              objective,task.criteria[run])))
+            progress.pushInfo(self.tr("Best objective value: {:.5E}".format(task.objective)))
+        elif len(task.criteria)==1:
+            progress.pushInfo(self.tr("Iterations stopped: {}".format(task.criteria[0])))
+
+        # report and tabulate the automatic selection of the number of clusters
+        selection_table = None
+        if task.scores:
+            for k,scores in sorted(task.scores.items()):
+                if scores is None:
+                    progress.pushInfo(self.tr("{} clusters: failed".format(k)))
+                else:
+                    progress.pushInfo(self.tr("{} clusters: SSE {:.5E}, ".format(k,scores[0])+ \
+                        "Calinski-Harabasz {:.5E}, simplified silhouette {:.4f}".format( \
+                        *scores[1:])))
+            progress.pushInfo(self.tr("Selected number of clusters: {}".format(task.k)))
+            fields = QgsFields()
+            fields.append(QgsField("k",QVariant.Int))
+            fields.append(QgsField("SSE",QVariant.Double))
+            fields.append(QgsField("Calinski_Harabasz",QVariant.Double))
+            fields.append(QgsField("Simplified_Silhouette",QVariant.Double))
+            fields.append(QgsField("Selected",QVariant.Int))
+            (sink, selection_table) = self.parameterAsSink(parameters, self.SelectionTable,
+                context, fields, QgsWkbTypes.NoGeometry, QgsCoordinateReferenceSystem())
+            if sink is not None:
+                for k,scores in sorted(task.scores.items()):
+                    feature = QgsFeature(fields)
+                    feature.setAttributes([k]+([None]*3 if scores is None else \
+                                          [float(score) for score in scores])+[int(k==task.k)])
+                    sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+        # report quality metrics of the clusters
+        if task.metrics is not None:
+            metrics = task.metrics
+            progress.pushInfo(self.tr("Points per cluster: {}".format( \
+                ",".join("{:g}".format(size) for size in metrics["sizes"]))))
+            progress.pushInfo(self.tr("Sum of squared errors per cluster: {}".format( \
+                ",".join("{:.5E}".format(inertia) for inertia in metrics["inertia"]))))
+            progress.pushInfo(self.tr("Calinski-Harabasz index: {:.5E}".format( \
+                metrics["calinski_harabasz"])))
+            progress.pushInfo(self.tr("Davies-Bouldin index: {:.4f}".format( \
+                metrics["davies_bouldin"])))
+            progress.pushInfo(self.tr("Simplified silhouette: {:.4f}".format( \
+                metrics["simplified_silhouette"])))
+            if metrics["silhouette"] is not None:
+                progress.pushInfo(self.tr("Silhouette of {} sampled points: {:.4f}".format( \
+                    min(SilhouetteSampleSize,len(task.get_arrays())),metrics["silhouette"])))
+
+        # save final centroids for a warm start of the next run
+        if OutputModel and task.centers is not None:
+            self.write_centroid_file(OutputModel,task.centers,AttribValues,
+                                     attr_centers,standard_factor,sRs,
+                                     PercentAttrib,Distance_Type==1,
+                                     context.project().ellipsoid())
+            progress.pushInfo(self.tr("Cluster model written to {}".format(OutputModel)))
+
+        # clusters of the additional cuts and the full dendrogram
+        cut_clusters = {}
+        for k in cuts:
+            if "Bisecting K-Means" in task.description():
+                if not task.result:
+                    break
+                if len(task.split_tree)<k-1:
+                    progress.pushInfo(self.tr("Split tree cannot be cut into "+ \
+                                              "{} clusters".format(k)))
+                    continue
+                cut_clusters[k] = task.cut_split_tree(k)
+                continue
+            if task.merges is None:
+                break
+            if len(task.get_arrays())-k>len(task.merges):
+                progress.pushInfo(self.tr("Cluster tree cannot be cut into "+ \
+                                          "{} clusters".format(k)))
+                continue
+            cut_clusters[k] = task.cut(k)
+        leaves = [[key] for key in task.get_arrays().keys] if task.merges is not None else []
+
         if "Lance-Williams" in task.description() and AggregationPercentile>0:
             task.clusters = [task_add.return_members(cluster) for cluster in task.clusters]
+            for k in cut_clusters:
+                cut_clusters[k] = [task_add.return_members(cluster) for cluster in cut_clusters[k]]
+            leaves = [task_add.return_members(leaf) for leaf in leaves]
+
+        # save the full merge table for later cuts
+        if OutputDendrogram and task.merges is not None:
+            pointer = linkage_pointer(len(leaves),task.merges) \
+                      if "SLINK" in task.description() else None
+            self.write_dendrogram_file(OutputDendrogram,leaves,task.merges,task.link,
+                                       pointer,AttribValues,attr_centers,standard_factor,
+                                       PercentAttrib,Distance_Type==1)
+            progress.pushInfo(self.tr("Dendrogram written to {}".format(OutputDendrogram)))
                 
         del points
 
@@ -337,6 +884,12 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
         for idx,cluster in enumerate(task.clusters):
             for key in cluster:
                 cluster_id[key] = idx
+        # noise points of density-based clustering
+        for key in task.noise:
+            cluster_id[key] = -1
+        if "DBSCAN" in task.description():
+            progress.pushInfo(self.tr("{} clusters and {} noise points found".format( \
+                                      len(task.clusters),len(task.noise))))
 
         progress.pushInfo(self.tr("Writing output field Cluster_ID"))
         
@@ -354,8 +907,29 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
         for key in cluster_id.keys():
             vlayer_new.dataProvider().changeAttributeValues({key:{icl:cluster_id[key]}})
 
+        # output additional cuts of the cluster tree as fields Cluster_ID_k
+        if cut_clusters:
+            names = ["Cluster_ID_{}".format(k) for k in cut_clusters]
+            progress.pushInfo(self.tr("Writing output fields {}".format(",".join(names))))
+            fieldList = vlayer_new.dataProvider().fields()
+            existing = [fieldList.indexFromName(name) for name in names \
+                        if name in [field.name() for field in fieldList]]
+            if existing:
+                vlayer_new.dataProvider().deleteAttributes(existing)
+            vlayer_new.dataProvider().addAttributes([QgsField(name,QVariant.Int) for name in names])
+            vlayer_new.updateFields()
+            fieldList = vlayer_new.dataProvider().fields()
+            values = {}
+            for name,clusters in zip(names,cut_clusters.values()):
+                icl = fieldList.indexFromName(name)
+                for idx,cluster in enumerate(clusters):
+                    for key in cluster:
+                        values.setdefault(key,{})[icl] = idx
+            vlayer_new.dataProvider().changeAttributeValues(values)
+
         # output cluster weights for Fuzzy C-Means as string
-        if "Fuzzy C-Means" in task.description():
+        if "Fuzzy C-Means" in task.description() and task.result and \
+           task.memberships is not None:
             if "Cluster_%" in [field.name() for field in fieldList]:
                 icl = fieldList.indexFromName("Cluster_%")
                 vlayer_new.dataProvider().deleteAttributes([icl])
@@ -365,12 +939,9 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
             # write output field in input layer
             fieldList = vlayer_new.dataProvider().fields()
             icl = fieldList.indexFromName("Cluster_%")
-            fuzzifier_reverse = 1.0/Fuzzifier
-            for key in cluster_id.keys():
+            for p,key in enumerate(task.get_arrays().keys):
                 vlayer_new.dataProvider().changeAttributeValues({key:{icl: \
-                    ",".join(map(str,[round(100* \
-                    task.weights[i][key]**fuzzifier_reverse,2) \
-                    for i in range(len(task.weights))]))}})
+                    ",".join(map(str,np.round(100*task.full_memberships(p),2).tolist()))}})
             
         # optionally output cluster feature membership here
         if verbose and "Lance-Williams" in task.description() and AggregationPercentile>0:
@@ -394,7 +965,23 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
 
         progress.setProgress(100)
         
-        return {self.Points:"Cluster_ID"}
+        results = {self.Points:"Cluster_ID"}
+        if OutputModel and task.centers is not None:
+            results[self.OutputModel] = OutputModel
+        if OutputDendrogram and task.merges is not None:
+            results[self.OutputDendrogram] = OutputDendrogram
+        if selection_table is not None:
+            results[self.SelectionTable] = selection_table
+        if task.metrics is not None:
+            results[self.ClusterSizes] = ",".join("{:g}".format(size) \
+                                                  for size in task.metrics["sizes"])
+            results[self.ClusterInertia] = ",".join("{:.5E}".format(inertia) \
+                                                    for inertia in task.metrics["inertia"])
+            results[self.CalinskiHarabasz] = task.metrics["calinski_harabasz"]
+            results[self.DaviesBouldin] = task.metrics["davies_bouldin"]
+            results[self.SimplifiedSilhouette] = task.metrics["simplified_silhouette"]
+            results[self.Silhouette] = task.metrics["silhouette"]
+        return results
 
     def name(self):
         """
@@ -456,13 +1043,95 @@ class ClusterPointsAlgorithm(QgsProcessingAlgorithm):
                 sd.append(cluster.distance2center(p))
         return fsum(sd)/len(sd)
 
+    def read_centroid_layer(self, layer, fields, crs, context):
+        """
+        Reads centroids (coordinates in crs and raw attribute values)
+        from the features of a point layer
+        """
+        transform = QgsCoordinateTransform(layer.crs(),crs,context.transformContext())
+        id_attr = [layer.fields().indexFromName(field) for field in fields]
+        for field,i in zip(fields,id_attr):
+            if i<0:
+                raise QgsProcessingException(
+                          "Field {} not found in centroid layer".format(field))
+        centroids = []
+        for infeat in layer.getFeatures():
+            point = transform.transform(infeat.geometry().asPoint())
+            values = [infeat[i] for i in id_attr]
+            if not all(v or v==0 for v in values):
+                raise QgsProcessingException("Centroid {} lacks attribute values".format( \
+                                             infeat.id()))
+            centroids.append([point.x(),point.y()]+[float(v) for v in values])
+        return centroids
+
+    def read_centroid_file(self, path, fields, crs, context):
+        """
+        Reads centroids (coordinates in crs and raw attribute values)
+        from the file of an earlier run
+        """
+        with open(path) as f:
+            model = json.load(f)
+        transform = QgsCoordinateTransform(QgsCoordinateReferenceSystem.fromWkt(model["crs"]),
+                                           crs,context.transformContext())
+        id_attr = []
+        for field in fields:
+            if field not in model["fields"]:
+                raise QgsProcessingException(
+                          "Field {} not found in centroid file".format(field))
+            id_attr.append(model["fields"].index(field))
+        centroids = []
+        for centroid in model["centroids"]:
+            point = transform.transform(QgsPointXY(centroid[0],centroid[1]))
+            centroids.append([point.x(),point.y()]+[centroid[2+i] for i in id_attr])
+        return centroids
+
+    def write_centroid_file(self, path, centers, fields, attr_centers, standard_factor, crs,
+                            pa=0, manhattan=False, ellipsoid="NONE"):
+        """
+        Writes final centroids with raw attribute values to a file together
+        with the distance definition needed to assign new points
+        """
+        model = {"crs":crs.toWkt(),
+                 "ellipsoid":ellipsoid}
+        model.update(centroid_model(centers,fields,attr_centers,standard_factor,pa,manhattan))
+        with open(path,'w') as f:
+            json.dump(model,f,indent=1)
+
+    def write_dendrogram_file(self, path, leaves, merges, link, pointer=None, fields=(),
+                              attr_centers=(), standard_factor=1.0, pa=0, manhattan=False):
+        """
+        Writes the merge table of a hierarchical run (representative rows,
+        height and size of the merged clusters) to a file together with
+        the feature IDs of every row, the distance definition and for SLINK
+        the pointer representation needed to insert new points
+        """
+        dendrogram = {"linkage":link,
+                      "distance_type":"Manhattan" if manhattan else "Euclidean",
+                      "percent_attrib":pa,
+                      "fields":list(fields),
+                      "attr_centers":[float(a) for a in attr_centers],
+                      "standard_factor":float(standard_factor),
+                      "leaves":[[int(key) for key in leaf] for leaf in leaves],
+                      "merges":[[int(i),int(j),float(height),float(size)] \
+                                for i,j,height,size in merges]}
+        if pointer is not None:
+            dendrogram["pi"] = [int(p) for p in pointer[0]]
+            dendrogram["lambda"] = [float(height) if np.isfinite(height) else None \
+                                    for height in pointer[1]]
+        with open(path,'w') as f:
+            json.dump(dendrogram,f)
+
 
 
 # Define task with required functions for each clustering algorithm
 
 class ClusterTask(QgsTask):
 
-    def __init__(self, description, link, points, pa, k, d, manhattan=False,fuzzifier=2.0):
+    def __init__(self, description, link, points, pa, k, d, manhattan=False,fuzzifier=2.0,
+                 init="k-means++", n_init=1, seed=None, max_iter=300, tol=0.0,
+                 label_fraction=0.0, coreset_size=0, initial=None, neighbours=0,
+                 split="sse", sample_size=0, eps=0.0, min_points=5, k_range=None,
+                 selection="calinski-harabasz", parent=None, deadline=None):
         super().__init__(description, QgsTask.CanCancel)
         self.link = link
         self.points = points
@@ -471,8 +1140,46 @@ class ClusterTask(QgsTask):
         self.d = d
         self.manhattan = manhattan
         self.m = fuzzifier
+        self.init = init
+        self.n_init = n_init
+        self.seed = seed
+        self.max_iter = max_iter
+        self.tol = tol
+        self.label_fraction = label_fraction
+        self.coreset_size = coreset_size
+        self.initial = initial
+        self.neighbours = neighbours
+        self.split = split
+        self.sample_size = sample_size
+        self.eps = eps
+        self.min_points = min_points
+        self.noise = []
+        self.k_range = k_range
+        self.selection = selection
+        self.parent = parent
+        self.deadline = deadline
+        self.scratch = None
+        self.cuts = []
+        self.connectivity = 0
+        self.pointer = None
+        self.scores = {}
+        self.silhouette_sample = 0
+        self.metrics = None
+        self.merges = None
+        self.split_tree = []
+        self.memberships = None
+        self.dissimilarities = None
+        self.membership_index = None
+        self.fit_arrays = None
+        self.fit_weights = None
+        self.centers = None
+        self.objective = None
+        self.objectives = []
+        self.criteria = []
+        self.arrays = None
         self.clusters = []
         self.tree_progress = 0
+        self.quiet = False
         
         self.result = None
 
@@ -481,21 +1188,40 @@ class ClusterTask(QgsTask):
             MESSAGE_CATEGORY, Qgis.Critical)
         super().cancel()
 
+    def isCanceled(self):
+        """
+        Tasks evaluating a single number of clusters follow their parent
+        """
+        return super().isCanceled() or \
+               (self.parent is not None and self.parent.isCanceled())
+
     def run(self):
         """
         Execution of task
         """
     
-        QgsMessageLog.logMessage(self.description(),MESSAGE_CATEGORY, Qgis.Info)
-        if self.description().startswith("K-Means"):
+        if not self.quiet:
+            QgsMessageLog.logMessage(self.description(),MESSAGE_CATEGORY, Qgis.Info)
+        if self.k_range is not None:
+            self.result = self.select_k()
+        elif self.description().startswith("K-Means"):
             self.result = self.kmeans()
         elif self.description().startswith("Fuzzy C-Means"):
             self.result = self.fuzzy_cmeans()
+        elif self.description().startswith("Bisecting K-Means"):
+            self.result = self.bisecting_kmeans()
+        elif self.description().startswith("K-Medoids"):
+            self.result = self.kmedoids()
+        elif self.description().startswith("DBSCAN"):
+            self.result = self.dbscan()
         elif self.description().startswith("Hierarchical"):
-            if "SLINK" in self.description():
+            if "SLINK" in self.description() and \
+               (self.pointer is not None or not self.spanning_tree()):
                 self.result = self.hcluster_slink()
             else:
                 self.result = self.hcluster()
+        if self.result and self.parent is None:
+            self.metrics = self.quality_metrics()
         return self.result
 
     def finished(self,result):
@@ -510,419 +1236,1049 @@ class ClusterTask(QgsTask):
              QgsMessageLog.logMessage(self.tr("Execution of clustering task failed"),
                        MESSAGE_CATEGORY, Qgis.Critical)
 
-    def init_kmeans_plusplus(self):
+    def subtask(self, k):
+        """
+        Returns a task with the same settings for k clusters
+        sharing the columnar points
+        """
+        task = ClusterTask(self.description(),self.link,self.points,self.pa,k,self.d,
+                           self.manhattan,self.m,self.init,self.n_init,self.seed,
+                           self.max_iter,self.tol,self.label_fraction,self.coreset_size,
+                           self.initial,self.neighbours,self.split,self.sample_size,
+                           self.eps,self.min_points,parent=self,deadline=self.deadline)
+        task.arrays = self.get_arrays()
+        task.cuts = self.cuts
+        return task
+
+    def cluster_labels(self, arrays=None):
+        """
+        Returns the cluster number of every point in row order
+        (-1 for points without cluster)
+        """
+        if arrays is None:
+            arrays = self.get_arrays()
+        rows = dict((key,i) for i,key in enumerate(arrays.keys))
+        labels = np.full(len(arrays),-1,dtype=np.intp)
+        for idx,cluster in enumerate(self.clusters):
+            labels[[rows[key] for key in cluster]] = idx
+        return labels
+
+    def quality_metrics(self):
+        """
+        Returns quality metrics of the clusters computed from the
+        columnar points (points without cluster are left out)
+        """
+        k = len(self.clusters)
+        if k < 2:
+            return None
+        arrays = self.get_arrays()
+        labels = self.cluster_labels(arrays)
+        rows = np.flatnonzero(labels>=0)
+        if len(rows) < len(arrays):
+            arrays,labels = arrays.subset(rows),labels[rows]
+        return cluster_metrics(arrays,labels,k,self.silhouette_sample,
+                               np.random.default_rng(self.seed))
+
+    def select_k(self):
+        """
+        Clusters the points for every number of clusters in k_range
+        concurrently and keeps the clustering with the best score
+        (elbow of the sum of squared errors, Calinski-Harabasz index
+        according to Calinski, T. and Harabasz, J. (1974) or simplified
+        silhouette according to Hruschka, E. R. et al. (2004))
+        """
+
+        arrays = self.get_arrays()
+        ks = list(self.k_range)
+
+        if self.description().startswith("Bisecting K-Means"):
+            # a single split tree contains the clusterings for all k
+            task = self.subtask(ks[-1])
+            if not task.bisecting_kmeans():
+                return False
+            tasks = {}
+            for k in ks:
+                tasks[k] = self.subtask(k)
+                tasks[k].clusters = task.cut_split_tree(k)
+                tasks[k].leaves,tasks[k].split_tree = task.leaves,task.split_tree
+                tasks[k].result = True
+        else:
+            tasks = dict((k,self.subtask(k)) for k in ks)
+            if self.description().startswith("K-Medoids") and \
+               self.medoid_sample_size(len(arrays)) == 0:
+                # one dissimilarity matrix for all numbers of clusters
+                dissimilarities = arrays.cdist(arrays)
+                for task in tasks.values():
+                    task.dissimilarities = dissimilarities
+            parallel_map(lambda task: task.run(),tasks.values())
+
+        if self.isCanceled():
+            return False
+
+        for k,task in tasks.items():
+            self.scores[k] = cluster_scores(arrays,task.cluster_labels(arrays),k) \
+                             if task.result else None
+        valid = [k for k in ks if self.scores[k] is not None]
+        if len(valid) == 0:
+            QgsMessageLog.logMessage(self.tr("Clustering failed for all numbers of clusters"),
+                MESSAGE_CATEGORY, Qgis.Critical)
+            return False
+
+        if self.selection == "elbow":
+            # sharpest bend: ratio of the SSE decrease before and after k
+            sse = np.array([self.scores[k][0] for k in valid])
+            if len(valid) < 3:
+                best = valid[0]
+            else:
+                decrease = sse[:-1]-sse[1:]
+                strength = decrease[:-1]/np.maximum(decrease[1:],float_info.epsilon*sse[0])
+                best = valid[1+int(np.argmax(strength))]
+        elif self.selection == "silhouette":
+            best = max(valid,key=lambda k: self.scores[k][2])
+        else:
+            best = max(valid,key=lambda k: self.scores[k][1])
+        QgsMessageLog.logMessage(self.tr("Selected {} clusters by {}".format( \
+            best,self.selection)),MESSAGE_CATEGORY, Qgis.Info)
+
+        # adopt the selected clustering
+        task = tasks[best]
+        self.k = best
+        for attribute in ("clusters","centers","objective","objectives","criteria",
+                          "memberships","membership_index","fit_arrays","fit_weights",
+                          "leaves","split_tree"):
+            if hasattr(task,attribute):
+                setattr(self,attribute,getattr(task,attribute))
+        if self.description().startswith("Bisecting K-Means"):
+            self.centers = arrays.means(task.cluster_labels(arrays),best,arrays.weights)
+        return True
+
+    def get_arrays(self):
+        """
+        Returns the columnar representation of the points (built on first use)
+        """
+        if self.arrays is None:
+            self.arrays = cluster_arrays(self.points,self.d,self.pa,self.manhattan)
+        return self.arrays
+
+    def init_centers(self, rng, arrays, sample_weights=None, k=None):
+        """
+        Initializes the cluster centers with the chosen method
+        and returns their row indices
+        """
+        if k is None:
+            k = self.k
+        if self.init == "k-means||":
+            return self.init_kmeans_parallel(rng,arrays,sample_weights,k)
+        return self.init_kmeans_plusplus(rng,arrays,k,sample_weights)
+
+    def draw(self, rng, weights):
+        """
+        Draws a random row index with probabilities proportional to weights
+        using a cumulative sum and binary search
+        """
+        cumulative = np.cumsum(weights)
+        p = rng.uniform(0,cumulative[-1]-float_info.epsilon)
+        return min(int(np.searchsorted(cumulative,p,side='right')),len(weights)-1)
+
+    def init_kmeans_plusplus(self, rng, arrays=None, k=None, sample_weights=None, rows=None):
         """
         Initializes the K-means algorithm according to
         Arthur, D. and Vassilvitskii, S. (2007)
         Referred to as K-means++
+        Returns the row indices of the chosen centers
         """
         
-        keys = list(self.points.keys())
+        if arrays is None:
+            arrays = self.get_arrays()
+        if k is None:
+            k = self.k
         
-        # draw first point randomly from dataset with uniform weights
-        p = random.choice(keys)
-        inits = [KMCluster(set([p]),self.points[p], self.d, self.pa, self.manhattan)]
+        if rows is None:
+            # draw first point randomly from dataset with uniform (or sample) weights
+            if sample_weights is None:
+                rows = [int(rng.integers(len(arrays)))]
+            else:
+                rows = [self.draw(rng,sample_weights)]
+        else:
+            rows = list(rows)
+        
+        # minimum distances to the chosen centers are only updated for the newest one
+        min_dist = arrays.nearest(arrays.subset(rows))[1]
         
         # loop until k points were found
-        while len(inits)<self.k:
-            # define new probability weights for sampling
-            weights = [min([inits[i].distance2center(self.points[p]) \
-                       for i in range(len(inits))]) for p in keys]
-            # draw new point randomly with probability weights
-            p = random.uniform(0,sum(weights)-float_info.epsilon)
-            p = bisect([sum(weights[:i+1]) for i in range(len(weights))],p)
-            p = keys[p]
-            inits.append(KMCluster(set([p]),self.points[p], self.d, self.pa, self.manhattan))
+        while len(rows)<k:
+            if self.isCanceled():
+                return None
+            if self.deadline is not None and time() >= self.deadline:
+                # complete the centers by uniform draws once the budget is exhausted
+                others = np.flatnonzero(min_dist>0)
+                if len(others) >= k-len(rows):
+                    rows.extend(rng.choice(others,size=k-len(rows),replace=False).tolist())
+                    QgsMessageLog.logMessage(self.tr("Time budget exhausted, "+ \
+                        "remaining centers drawn uniformly"),MESSAGE_CATEGORY, Qgis.Warning)
+                    break
+            # draw new point randomly with probabilities proportional to the
+            # (weighted) squared distance to the closest chosen center
+            p = self.draw(rng,min_dist**2 if sample_weights is None else \
+                              min_dist**2*sample_weights)
+            rows.append(p)
+            np.minimum(min_dist,arrays.cdist(arrays.subset([p]))[:,0],out=min_dist)
             
-        return inits
+        return rows
 
-    def kmeans(self):
+    def init_kmeans_parallel(self, rng, arrays=None, sample_weights=None, k=None):
+        """
+        Initializes the K-means algorithm according to
+        Bahmani, B. et al. (2012)
+        Referred to as K-means||
+        Candidates are oversampled in a few rounds, weighted by the number
+        of points closest to them and reduced to k centers with K-means++
+        """
+
+        if arrays is None:
+            arrays = self.get_arrays()
+        if sample_weights is None:
+            sample_weights = np.ones(len(arrays))
+        if k is None:
+            k = self.k
+        oversampling = 2*k
+
+        # draw first point randomly from dataset with sample weights
+        rows = [self.draw(rng,sample_weights)]
+        min_dist = arrays.cdist(arrays.subset(rows))[:,0]
+
+        # sample candidates independently with probability proportional to squared distance
+        for i in range(number_oversampling_rounds):
+            if self.isCanceled():
+                return None
+            if self.deadline is not None and time() >= self.deadline:
+                break
+            cost = np.dot(sample_weights,min_dist**2)
+            if cost == 0:
+                break
+            new = np.flatnonzero(rng.random(len(arrays))< \
+                                 oversampling*sample_weights*min_dist**2/cost)
+            if len(new) == 0:
+                continue
+            rows.extend(new.tolist())
+            np.minimum(min_dist,arrays.nearest(arrays.subset(new))[1],out=min_dist)
+
+        if len(rows)<=k:
+            return self.init_kmeans_plusplus(rng,arrays,k,sample_weights,rows)
+
+        # weight candidates by their number of closest points and recluster them
+        candidates = arrays.subset(rows)
+        labels = arrays.nearest(candidates)[0]
+        counts = np.bincount(labels,weights=sample_weights,minlength=len(rows))
+        QgsMessageLog.logMessage(self.tr("{} candidates ".format(len(rows))+ \
+            "oversampled in {} rounds".format(i+1)),MESSAGE_CATEGORY, Qgis.Info)
+        chosen = self.init_kmeans_plusplus(rng,candidates,k,counts)
+        if chosen is None:
+            return None
+
+        return [rows[j] for j in chosen]
+
+    def build_coreset(self, rng):
+        """
+        Builds a weighted coreset by sensitivity sampling according to
+        Bachem, O., Lucic, M. and Krause, A. (2017)
+        Practical Coreset Constructions for Machine Learning
+        A rough K-means++ solution bounds the sensitivity of every point.
+        With a coreset size in O(k*(a*log(k)+log(1/delta))/epsilon**2),
+        a denoting the number of dimensions, the weighted cost of any k
+        centers lies within a factor of 1+-epsilon of the cost on all
+        points with probability 1-delta.
+        Returns the coreset points and their weights
+        """
+
+        arrays = self.get_arrays()
+        n = len(arrays)
+        mass = np.ones(n) if arrays.weights is None else arrays.weights
+
+        # rough solution from a single K-means++ pass
+        rows = self.init_kmeans_plusplus(rng,arrays,sample_weights=arrays.weights)
+        if rows is None:
+            return None,None
+        labels,mindist = arrays.nearest(arrays.subset(rows))
+
+        # upper bounds of the sensitivities
+        cost = mindist**2
+        mean_cost = np.dot(mass,cost)/mass.sum()
+        counts = np.bincount(labels,weights=mass,minlength=self.k)
+        alpha = 16*(np.log(self.k)+2)
+        sensitivity = 4.0*mass.sum()/counts[labels]
+        if mean_cost > 0:
+            cluster_cost = np.bincount(labels,weights=mass*cost,minlength=self.k)
+            sensitivity += alpha*cost/mean_cost+ \
+                           2*alpha*cluster_cost[labels]/(counts[labels]*mean_cost)
+        q = mass*sensitivity
+        q /= q.sum()
+
+        # sample with replacement and merge repeatedly drawn points
+        sample = rng.choice(n,size=self.coreset_size,p=q)
+        rows,repeats = np.unique(sample,return_counts=True)
+        weights = mass[rows]*repeats/(self.coreset_size*q[rows])
+        # the weights estimate the total weight of all points, keep it exact
+        weights *= mass.sum()/weights.sum()
+
+        return arrays.subset(rows),weights
+
+    def fuzzy_memberships(self, distance):
+        """
+        Returns the k x n fuzzy memberships for the distances
+        of all points (columns) to the cluster centers (rows)
+        """
+        cutoff = 1.e6*float_info.epsilon
+        u = np.maximum(distance,cutoff)**(-2.0/(self.m-1.0))
+        u /= u.sum(axis=0)
+        return u
+
+    def stopping_criterion(self, loopCounter, shift, objective, previous, changed,
+                           earlier=None):
+        """
+        Checks the convergence criteria of iterative algorithms and
+        returns a description of the criterion which is met (or None),
+        earlier is the objective value before the previous one
+        """
 
         # Set cut-off distance for termination of iterations
         cutoff=1.e6*float_info.epsilon
 
-        # Create k clusters using the K-means++ initialization method
-        QgsMessageLog.logMessage(self.tr(
-            "Initializing clusters with K-means++"),
-            MESSAGE_CATEGORY, Qgis.Info)
-        clusters = self.init_kmeans_plusplus()
-        QgsMessageLog.logMessage(self.tr(
-            "{} clusters successfully initialized".format(self.k)),
-            MESSAGE_CATEGORY, Qgis.Info)
+        if shift < cutoff:
+            criterion = "centroid shift below {:.1E}".format(cutoff)
+        elif self.tol > 0 and previous is not None and \
+             previous-objective <= self.tol*abs(previous):
+            criterion = "relative objective change below {:.1E}".format(self.tol)
+        elif self.label_fraction > 0 and changed is not None and \
+             changed < self.label_fraction:
+            criterion = "fraction of changed labels below {}".format(self.label_fraction)
+        elif loopCounter >= self.max_iter:
+            criterion = "maximum number of iterations"
+        elif self.deadline is not None and time() >= self.deadline:
+            criterion = "time budget exhausted"
+            self.log_objective_gap(objective,previous,earlier)
+        else:
+            return None
+
+        QgsMessageLog.logMessage(self.tr("Stopped after {} iterations: {}".format( \
+            loopCounter,criterion)),MESSAGE_CATEGORY,
+            Qgis.Warning if loopCounter >= self.max_iter else Qgis.Success)
+        return criterion
+
+    def log_objective_gap(self, objective, previous, earlier):
+        """
+        Logs the remaining objective gap of an interrupted run extrapolated
+        from the geometric decay of the last two objective decreases
+        """
+        if previous is None or earlier is None or previous-objective <= 0:
+            QgsMessageLog.logMessage(self.tr("Time budget exhausted, remaining "+ \
+                "objective gap unknown"),MESSAGE_CATEGORY, Qgis.Warning)
+            return
+        ratio = (previous-objective)/(earlier-previous) if earlier > previous else 1.0
+        if ratio < 1:
+            gap = (previous-objective)*ratio/(1-ratio)
+            QgsMessageLog.logMessage(self.tr("Time budget exhausted, remaining "+ \
+                "objective gap estimated at {:.5E} ({:.2%})".format(gap,gap/objective)),
+                MESSAGE_CATEGORY, Qgis.Warning)
+        else:
+            QgsMessageLog.logMessage(self.tr("Time budget exhausted, objective still "+ \
+                "decreasing by {:.5E} per iteration".format(previous-objective)),
+                MESSAGE_CATEGORY, Qgis.Warning)
+
+    def estimate_runtime(self):
+        """
+        Estimates the runtime of hierarchical clustering in seconds by
+        timing a quiet run on a random subset of the points (fixed seed
+        if none is given) and extrapolating with the typical order of growth
+        of the algorithms (quadratic, roughly linear for the minimum
+        spanning tree and connectivity graphs)
+        """
+        keys = list(self.points.keys())
+        n = len(keys)
+        m = min(n,number_timing_points)
+        seed = 0 if self.seed is None else self.seed
+        subset = dict((key,self.points[key]) for key in random.Random(seed).sample(keys,m))
+        task = ClusterTask(self.description(),self.link,subset,self.pa,min(self.k,m),
+                           self.d,self.manhattan,parent=self)
+        task.connectivity = self.connectivity
+        task.quiet = True
+        start = time()
+        task.run()
+        order = 1 if self.spanning_tree() or self.connectivity>0 else 2
+        return (time()-start)*(float(n)/m)**order
+
+    def restarts(self, fit, objective):
+        """
+        Runs n_init seeded fits concurrently, each with an independent
+        random number stream, and returns the result with the lowest objective
+        """
+
+        # Build the columnar points once for all runs, the first random
+        # number stream draws the coreset independently of the number of runs
+        arrays = self.get_arrays()
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_init+1)
+
+        # Optionally cluster a weighted coreset instead of all points
+        if 0 < self.coreset_size < len(arrays):
+            self.fit_arrays,self.fit_weights = self.build_coreset( \
+                                               np.random.default_rng(seeds[0]))
+            if self.fit_arrays is None:
+                return None
+            QgsMessageLog.logMessage(self.tr("Clustering weighted coreset of "+ \
+                "{} distinct points".format(len(self.fit_arrays))),
+                MESSAGE_CATEGORY, Qgis.Info)
+        else:
+            self.fit_arrays,self.fit_weights = arrays,arrays.weights
+
+        # Create k clusters using the K-means++ or K-means|| initialization method
+        if self.initial is not None:
+            QgsMessageLog.logMessage(self.tr(
+                "Initializing clusters with given centroids"),
+                MESSAGE_CATEGORY, Qgis.Info)
+            self.n_init = 1
+        else:
+            QgsMessageLog.logMessage(self.tr(
+                "Initializing clusters with {} ({} runs)".format(self.init,self.n_init)),
+                MESSAGE_CATEGORY, Qgis.Info)
+        rngs = [np.random.default_rng(s) for s in seeds[1:]]
+
+        results = parallel_map(fit,rngs[:self.n_init])
+
+        if self.isCanceled():
+            return None
+
+        self.objectives = [None if result is None else result[0] for result in results]
+        self.criteria = [None if result is None else result[-1] for result in results]
+        for run,result in enumerate(results):
+            if result is None:
+                QgsMessageLog.logMessage(self.tr("Run {} failed".format(run+1)),
+                    MESSAGE_CATEGORY, Qgis.Warning)
+            else:
+                QgsMessageLog.logMessage(self.tr("Run {}: {} {:.5E}".format( \
+                    run+1,objective,result[0])),MESSAGE_CATEGORY, Qgis.Info)
+
+        results = [result for result in results if result is not None]
+        if len(results) == 0:
+            QgsMessageLog.logMessage(self.tr("Algorithm failed: Choose a "+ \
+                                     "different random seed or "+ \
+                                     "a smaller number of clusters"),
+                                     MESSAGE_CATEGORY, Qgis.Critical)
+            return None
+
+        best = min(results,key=lambda result: result[0])
+        self.objective = best[0]
+        if self.n_init > 1:
+            QgsMessageLog.logMessage(self.tr("Keeping run with lowest "+ \
+                "{} {:.5E}".format(objective,best[0])),MESSAGE_CATEGORY, Qgis.Info)
+        return best
+
+    def kmeans(self):
+
+        best = self.restarts(self.kmeans_fit,"inertia")
+        if best is None:
+            return False
+
+        # label all points in one pass if only the coreset was clustered
+        arrays = self.get_arrays()
+        self.centers,labels = best[1],best[2]
+        if self.fit_arrays is not arrays:
+            labels = arrays.nearest(self.centers)[0]
+
+        self.clusters = arrays.groups(labels,self.k)
+        return True
+
+    def kmeans_fit(self, rng, arrays=None, sample_weights=None, k=None):
+        """
+        Single run of the K-means algorithm (Lloyd) on the columnar points,
+        returns the inertia, the centers and the labels or None on failure
+        """
+
+        if arrays is None:
+            arrays,sample_weights = self.fit_arrays,self.fit_weights
+        if k is None:
+            k = self.k
+        if self.initial is None or k != self.k:
+            rows = self.init_centers(rng,arrays,sample_weights,k)
+            if rows is None:
+                return None
+            centers = arrays.subset(rows)
+        else:
+            centers = arrays.centers(*self.initial)
     
         # Loop through the dataset until the clusters stabilize
         loopCounter = 0
+        inertia = None
+        previous = None
+        labels = None
         while True:
 
             if self.isCanceled():
-                return False
+                return None
 
-            # Create a list of lists to hold the points in each cluster
-            setList = [set() for i in range(self.k)]
-        
             # Start counting loops
             loopCounter += 1
 
-            # For every point in the dataset ...
-            for p in list(self.points.keys()):
-                # Get the distance between that point and the all the cluster centroids
-                smallest_distance = float_info.max
-        
-                for i in range(self.k):
-                    distance = clusters[i].distance2center(self.points[p])
-                    if distance < smallest_distance:
-                        smallest_distance = distance
-                        clusterIndex = i
-                setList[clusterIndex].add(p)
-        
-            # Set biggest_shift to zero for this iteration
-            biggest_shift = 0.0
-        
-            for i in range(self.k):
-                # Calculate new centroid coordinates
-                numPoints = len(setList[i])
-                if numPoints == 0:
-                    QgsMessageLog.logMessage(self.tr("Algorithm failed after "+ \
-                                             "{} iterations: Choose a ".format(loopCounter)+ \
-                                             "different random seed or "+ \
-                                             "a smaller number of clusters"),
-                                             MESSAGE_CATEGORY, Qgis.Critical)
-                    return False
-                centerpoint = QgsGeometry.fromPolyline([self.points[p] \
-                                         for p in setList[i]]).centroid().asPoint()
-                centerpoint = Cluster_point(centerpoint)
-                for j in range(clusters[i].centerpoint.attr_size):
-                    centerpoint.addAttribute(sum([self.points[p].attributes[j] \
-                                         for p in setList[i]])/numPoints)
-                # Calculate how far the centroid moved in this iteration
-                shift = clusters[i].update(setList[i], centerpoint)
-                # Keep track of the largest move from all cluster centroid updates
-                biggest_shift = max(biggest_shift, shift)
-
-            # If the centroids have stopped moving much, say we're done!
-            if biggest_shift < cutoff:
-                #self.progress.setProgress(90)
-                QgsMessageLog.logMessage(self.tr(
-                    "Converged after {} iterations").format(loopCounter),
-                    MESSAGE_CATEGORY, Qgis.Success)
+            # Assign every point to the closest cluster centroid
+            earlier,previous,previous_labels = previous,inertia,labels
+            labels,mindist = arrays.nearest(centers)
+            if np.bincount(labels,minlength=k).min() == 0:
+                QgsMessageLog.logMessage(self.tr("Empty cluster after "+ \
+                                         "{} iterations".format(loopCounter)),
+                                         MESSAGE_CATEGORY, Qgis.Warning)
+                return None
+            inertia = float(np.dot(mindist,mindist if sample_weights is None \
+                                    else sample_weights*mindist))
+            changed = None if previous_labels is None else \
+                      np.count_nonzero(labels!=previous_labels)/float(len(labels))
+
+            # Calculate new centroid coordinates
+            new_centers = arrays.means(labels,k,sample_weights)
+            # Calculate how far the centroids moved in this iteration
+            biggest_shift = new_centers.paired_distance(centers).max()
+
+            # Stop as soon as one of the convergence criteria is met
+            criterion = self.stopping_criterion(loopCounter,biggest_shift,
+                                                inertia,previous,changed,earlier)
+            if criterion is not None:
                 break
-    
-        self.clusters = [c.ids for c in clusters]
-        return True
+            centers = new_centers
+
+        # final assignment to the updated centroids (unless a cluster runs empty)
+        new_labels,mindist = arrays.nearest(new_centers)
+        if np.bincount(new_labels,minlength=k).min() > 0:
+            centers,labels = new_centers,new_labels
+            inertia = float(np.dot(mindist,mindist if sample_weights is None \
+                                    else sample_weights*mindist))
+
+        return inertia,centers,labels,criterion
 
     def fuzzy_cmeans(self):
 
-        m_exponent = -2.0/(self.m-1.0)
+        best = self.restarts(self.fuzzy_cmeans_fit,"objective")
+        if best is None:
+            return False
 
-        # Set cut-off distance for termination of iterations
-        cutoff=1.e6*float_info.epsilon
+        # derive memberships of all points if only the coreset was clustered
+        arrays = self.get_arrays()
+        self.centers,self.memberships,self.membership_index = best[1],best[2],best[3]
+        if self.fit_arrays is not arrays:
+            if self.membership_index is None:
+                self.memberships = self.fuzzy_memberships(arrays.cdist(self.centers).T)
+            else:
+                index,distance = arrays.k_nearest(self.centers,self.neighbours)
+                self.membership_index = index.T
+                self.memberships = self.fuzzy_memberships(distance.T)
 
-        # Create k clusters using the K-means++ initialization method
-        QgsMessageLog.logMessage(self.tr(
-            "Initializing clusters with K-means++"),
-            MESSAGE_CATEGORY, Qgis.Info)
-        clusters = self.init_kmeans_plusplus()
-        QgsMessageLog.logMessage(self.tr(
-            "{} clusters successfully initialized".format(self.k)),
-            MESSAGE_CATEGORY, Qgis.Info)
+        # assign the cluster with the highest membership to each point
+        self.clusters = arrays.groups(self.membership_labels(self.memberships,
+                                      self.membership_index),self.k)
+        return True
+
+    def membership_labels(self, u, index=None):
+        """
+        Returns the cluster with the highest membership for every point,
+        index holds the cluster numbers of truncated memberships
+        """
+        rank = u.argmax(axis=0)
+        if index is None:
+            return rank
+        return index[rank,np.arange(len(rank))]
+
+    def full_memberships(self, p):
+        """
+        Returns the memberships of the point in column p to all k clusters
+        """
+        if self.membership_index is None:
+            return self.memberships[:,p]
+        u = np.zeros(self.k)
+        u[self.membership_index[:,p]] = self.memberships[:,p]
+        return u
+
+    def fuzzy_cmeans_fit(self, rng):
+        """
+        Single run of the Fuzzy C-means algorithm on a dense k x n membership
+        array, returns the objective, the centers and the memberships or None on failure
+        """
+
+        arrays,sample_weights = self.fit_arrays,self.fit_weights
+        mass = np.ones(len(arrays)) if sample_weights is None else sample_weights
+        if self.initial is None:
+            rows = self.init_centers(rng,arrays,sample_weights)
+            if rows is None:
+                return None
+            centers = arrays.subset(rows)
+        else:
+            centers = arrays.centers(*self.initial)
+        columns = np.column_stack([arrays.xy,arrays.attributes])
+        truncated = 0 < self.neighbours < self.k
+
+        def memberships(centers):
+            # standardised distances between all points and (nearest) cluster centroids
+            if truncated:
+                index,distance = arrays.k_nearest(centers,self.neighbours)
+                index,distance = index.T,distance.T
+            else:
+                index,distance = None,arrays.cdist(centers).T
+            u = self.fuzzy_memberships(distance)
+            # power here for cluster centers
+            weights = u**self.m
+            weights *= mass
+            # Sum of weighted squared distances (objective function)
+            objective = float(np.einsum('ij,ij->',weights,distance*distance))
+            return index,u,weights,objective
     
         # Loop through the dataset until the clusters stabilize
         loopCounter = 0
+        objective = None
+        previous = None
+        labels = None
         while True:
 
             if self.isCanceled():
-                return False
+                return None
 
-            # Create a list of lists to hold the points in each cluster
-            weights = [{} for i in range(self.k)]
-        
             # Start counting loops
             loopCounter += 1
-
-            # For every point in the dataset ...
-            for p in list(self.points.keys()):
-                # Get the standardised distance between that point and all the cluster centroids
-                sum_of_weights = 0.0
-        
-                for i in range(self.k):
-                    distance = clusters[i].distance2center(self.points[p])
-                    weights[i][p] = distance**m_exponent if \
-                                        distance > cutoff else cutoff**m_exponent
-                    sum_of_weights += weights[i][p]
-                    
-                for i in range(self.k):
-                    weights[i][p] = (weights[i][p]/sum_of_weights)**self.m
-                    # power here for cluster centers / needs to be undone at the end
-        
-            # Set biggest_shift to zero for this iteration
-            biggest_shift = 0.0
-        
-            for i in range(self.k):
-                # Calculate new centroid coordinates
-                sum_of_weights = sum(weights[i].values())
-                centerpoint = QgsPointXY(sum([self.points[p].x()*weights[i][p] for \
-                                            p in weights[i].keys()])/ \
-                                            sum_of_weights, \
-                                         sum([self.points[p].y()*weights[i][p] for \
-                                            p in weights[i].keys()])/ \
-                                            sum_of_weights)
-                centerpoint = Cluster_point(centerpoint)
-                for j in range(clusters[i].centerpoint.attr_size):
-                    centerpoint.addAttribute(sum([self.points[p].attributes[j]*weights[i][p] \
-                                         for p in weights[i].keys()])/ \
-                                         sum_of_weights)
-                # Calculate how far the centroid moved in this iteration
-                shift = clusters[i].update(weights[i], centerpoint)
-                # Keep track of the largest move from all cluster centroid updates
-                biggest_shift = max(biggest_shift, shift)
-
-            # If the centroids have stopped moving much, say we're done!
-            if biggest_shift < cutoff:
-                #self.progress.setProgress(90)
-                QgsMessageLog.logMessage(self.tr(
-                    "Converged after {} iterations").format(loopCounter),
-                    MESSAGE_CATEGORY, Qgis.Success)
+            earlier,previous = previous,objective
+
+            # Get the memberships of all points to the (nearest) cluster centroids
+            index,u,weights,objective = memberships(centers)
+
+            # Count points changing the cluster with the highest weight
+            changed = None
+            if self.label_fraction > 0:
+                previous_labels = labels
+                labels = self.membership_labels(u,index)
+                if previous_labels is not None:
+                    changed = np.count_nonzero(labels!=previous_labels)/float(len(labels))
+
+            # Calculate new centroid coordinates as weighted means
+            if truncated:
+                total = np.bincount(index.ravel(),weights=weights.ravel(),minlength=self.k)
+                sums = np.column_stack([np.bincount(index.ravel(),weights=(weights*column).ravel(),
+                                        minlength=self.k) for column in columns.T])
+                # clusters not near to any point keep their centroids
+                empty = total == 0
+                sums[empty] = np.column_stack([centers.xy,centers.attributes])[empty]
+                total[empty] = 1
+            else:
+                total = weights.sum(axis=1)
+                sums = weights@columns
+            sums /= total[:,None]
+            new_centers = arrays.centers(sums[:,:2],sums[:,2:])
+            # Calculate how far the centroids moved in this iteration
+            biggest_shift = new_centers.paired_distance(centers).max()
+            centers = new_centers
+
+            # Stop as soon as one of the convergence criteria is met
+            criterion = self.stopping_criterion(loopCounter,biggest_shift,
+                                                objective,previous,changed,earlier)
+            if criterion is not None:
                 break
-        
-        # assign the cluster with the highest weight to each point
-        max_clusters = [[] for i in range(self.k)]
-        for p in self.points.keys():
-            i = argmax([weights[i][p] for i in range(self.k)])
-            max_clusters[i].append(p)
-    
-        self.clusters = max_clusters
-        self.weights = weights
-        return True
 
-    def hcluster(self):
+        # final memberships to the updated centroids
+        index,u,weights,objective = memberships(centers)
+        return objective,centers,u,index,criterion
 
-        clust={}
-        distances={}
-        currentclustid=-1
-        numPoints=len(self.points)
-        
-        if numPoints==0:
-            QgsMessageLog.logMessage(self.tr("No points provided"),
-                MESSAGE_CATEGORY, Qgis.Critical)
-            return False   
+    def bisecting_kmeans(self):
+        """
+        Divisive hierarchical clustering with Bisecting K-means according to
+        Steinbach, M., Karypis, G. and Kumar, V. (2000)
+        The cluster with the highest sum of squared errors (or the most points)
+        is repeatedly split by the best of n_init 2-means runs. The split
+        tree is kept to derive clusters for other numbers of clusters
+        (splitting goes on for the largest of the additional cuts).
+        """
+
+        arrays = self.get_arrays()
+        rngs = [np.random.default_rng(s) for s in \
+                np.random.SeedSequence(self.seed).spawn(self.n_init)]
+
+        # the root node 0 holds all points
+        mass = np.ones(len(arrays)) if arrays.weights is None else arrays.weights
+        leaves = {0:np.arange(len(arrays))}
+        root = arrays.means(np.zeros(len(arrays),dtype=np.intp),1,arrays.weights)
+        sse = {0:float(np.dot(mass,arrays.cdist(root)[:,0]**2))}
+        self.split_tree = []
+        next_node = 1
+        depth = max([self.k]+list(self.cuts))
+
+        while len(leaves)<depth:
 
-        # clusters are initially singletons
-        for ik,p in zip(range(numPoints-1, -1, -1), self.points.keys()):
-            clust[ik] = Cluster_node(members=[p],d=self.d,pa=self.pa,manhattan=self.manhattan)
-        
-        # compute pairwise distances
-        for ik in clust.keys():
             if self.isCanceled():
                 return False
-            for jk in clust.keys():
-                if jk<ik:
-                    distances[(ik,jk)]=clust[ik].getDistance(self.points[clust[ik].members[0]], \
-                                       self.points[clust[jk].members[0]])
 
-        while currentclustid>=self.k-numPoints:
-        
-            if self.isCanceled():
+            # pick the cluster to split next
+            candidates = [node for node in leaves.keys() if sse[node]>0]
+            if len(candidates) == 0 and len(leaves) >= self.k:
+                break
+            if len(candidates) == 0:
+                QgsMessageLog.logMessage(self.tr("Too little distinct points "+ \
+                    "available for {} clusters".format(self.k)),
+                    MESSAGE_CATEGORY, Qgis.Critical)
                 return False
-        
-            closest = float_info.max
-    
-            # loop through every pair looking for the smallest distance
-            for ik in clust.keys():
-                for jk in clust.keys():
-                    if jk<ik:
-                        dist=distances[(ik,jk)]
-                        if dist<closest:
-                            closest=dist
-                            ik_lowest=ik
-                            jk_lowest=jk
-            
-            # detect clusters to merge
-            ik = ik_lowest
-            jk = jk_lowest
-            
-            # create the new cluster
-            clust[currentclustid]=Cluster_node(members=clust[ik].members+ \
-                                  clust[jk].members,d=self.d,pa=self.pa)
-                                  
-            # compute updated distances according to the Lance-Williams algorithm
-            
-            if self.link == 'single':
-
-                alpha_i = 0.5
-                alpha_j = 0.5
-                gamma = -0.5
-                for lk in clust.keys():
-                    if lk not in (ik,jk,currentclustid):
-                        jl = (jk,lk) if jk>lk else (lk,jk)
-                        il = (ik,lk) if ik>lk else (lk,ik)
-                        distances[(lk,currentclustid)] = alpha_i*distances[il]+ \
-                                  alpha_j*distances[jl]+gamma*abs(distances[il]-distances[jl])
-
-            elif self.link == 'complete':
-            
-                alpha_i = 0.5
-                alpha_j = 0.5
-                gamma = 0.5
-                for lk in clust.keys():
-                    if lk not in (ik,jk,currentclustid):
-                        jl = (jk,lk) if jk>lk else (lk,jk)
-                        il = (ik,lk) if ik>lk else (lk,ik)
-                        distances[(lk,currentclustid)] = alpha_i*distances[il]+ \
-                                  alpha_j*distances[jl]+gamma*abs(distances[il]-distances[jl])
-
-            elif self.link == 'median':
-            
-                alpha_i = 0.5
-                alpha_j = 0.5
-                beta = -0.25
-                for lk in clust.keys():
-                    if lk not in (ik,jk,currentclustid):
-                        jl = (jk,lk) if jk>lk else (lk,jk)
-                        il = (ik,lk) if ik>lk else (lk,ik)
-                        distances[(lk,currentclustid)] = alpha_i*distances[il]+ \
-                                  alpha_j*distances[jl]+beta*distances[(ik,jk)]
-  
-            elif self.link == 'average':
-            
-                alpha_i = float(clust[ik].size)/clust[currentclustid].size
-                alpha_j = float(clust[jk].size)/clust[currentclustid].size
-                for lk in clust.keys():
-                    if lk not in (ik,jk,currentclustid):
-                        jl = (jk,lk) if jk>lk else (lk,jk)
-                        il = (ik,lk) if ik>lk else (lk,ik)
-                        distances[(lk,currentclustid)] = \
-                                  alpha_i*distances[il]+alpha_j*distances[jl]
-
-            elif self.link == 'wards':
-            
-                for lk in clust.keys():
-                    if lk not in (ik,jk,currentclustid):
-                        alpha_i = float(clust[ik].size+clust[lk].size)/ \
-                                  (clust[currentclustid].size+clust[lk].size)
-                        alpha_j = float(clust[jk].size+clust[lk].size)/ \
-                                  (clust[currentclustid].size+clust[lk].size)
-                        beta = -float(clust[lk].size)/ \
-                                (clust[currentclustid].size+clust[lk].size)
-                        jl = (jk,lk) if jk>lk else (lk,jk)
-                        il = (ik,lk) if ik>lk else (lk,ik)
-                        distances[(lk,currentclustid)] = alpha_i*distances[il]+ \
-                                  alpha_j*distances[jl]+beta*distances[(ik,jk)]
-
-            elif self.link == 'centroid':
-            
-                for lk in clust.keys():
-                    if lk not in (ik,jk,currentclustid):
-                        alpha_i = float(clust[ik].size)/clust[currentclustid].size
-                        alpha_j = float(clust[jk].size)/clust[currentclustid].size
-                        beta = -float(clust[ik].size*clust[jk].size)/ \
-                                (clust[currentclustid].size**2)
-                        jl = (jk,lk) if jk>lk else (lk,jk)
-                        il = (ik,lk) if ik>lk else (lk,ik)
-                        distances[(lk,currentclustid)] = alpha_i*distances[il]+ \
-                                  alpha_j*distances[jl]+beta*distances[(ik,jk)]
+            if self.split == "size":
+                node = max(candidates,key=lambda node: mass[leaves[node]].sum())
+            else:
+                node = max(candidates,key=lambda node: sse[node])
+            rows = leaves[node]
+            members = arrays.subset(rows)
+
+            # keep the best of n_init 2-means runs
+            results = [self.kmeans_fit(rng,members,members.weights,2) for rng in rngs]
+            results = [result for result in results if result is not None]
+            if len(results) == 0:
+                sse[node] = 0
+                continue
+            inertia,centers,labels,criterion = min(results,key=lambda result: result[0])
+
+            # sum of squared errors of both halves
+            dist = members.paired_distance(centers.subset(labels))
+            halves = np.bincount(labels,weights=mass[rows]*dist*dist,minlength=2)
+
+            self.split_tree.append((node,next_node,next_node+1))
+            del leaves[node]
+            for i in range(2):
+                leaves[next_node+i] = rows[labels==i]
+                sse[next_node+i] = float(halves[i])
+            next_node += 2
+
+            QgsMessageLog.logMessage(self.tr("Split {} of {}: {} points into {} and {}".format( \
+                len(self.split_tree),depth-1,len(rows),*np.bincount(labels,minlength=2))),
+                MESSAGE_CATEGORY, Qgis.Info)
+
+        self.leaves = dict((node,[arrays.keys[i] for i in rows]) for node,rows in leaves.items())
+        self.clusters = self.cut_split_tree(self.k)
+        self.centers = arrays.means(self.cluster_labels(arrays),self.k,arrays.weights)
+        return True
 
+    def cut_split_tree(self, k):
+        """
+        Returns the cluster members of Bisecting K-means
+        if only the first k-1 splits are applied
+        """
+        parent = {}
+        for node,left,right in self.split_tree:
+            parent[left] = node
+            parent[right] = node
+        active = set([0])
+        for node,left,right in self.split_tree[:k-1]:
+            active.discard(node)
+            active.update((left,right))
+        clusters = {}
+        for leaf,members in self.leaves.items():
+            node = leaf
+            while node not in active:
+                node = parent[node]
+            clusters.setdefault(node,[]).extend(members)
+        # numbered in the order the clusters were created
+        return [clusters[node] for node in sorted(clusters)]
+
+    def kmedoids(self):
+        """
+        K-medoids clustering with the FasterPAM swap algorithm according to
+        Schubert, E. and Rousseeuw, P. J. (2021)
+        For large datasets the medoids are searched in random samples
+        and evaluated on all points (CLARA, Kaufman and Rousseeuw 1990)
+        """
+
+        arrays = self.get_arrays()
+        n = len(arrays)
+        rng = np.random.default_rng(self.seed)
+        sample_size = self.medoid_sample_size(n)
+        sampling = sample_size > 0
+        if sampling and not 0 < self.sample_size < n:
+            QgsMessageLog.logMessage(self.tr("Dissimilarities of {} points ".format(n)+ \
+                "exceed the memory limit, searching medoids in samples of "+ \
+                "{} points".format(sample_size)),MESSAGE_CATEGORY, Qgis.Warning)
+
+        best = None
+        for i in range(number_clara_samples if sampling else 1):
+
+            if sampling:
+                # each sample contains the best medoids found so far
+                rows = np.array([],dtype=np.intp) if best is None else best[1]
+                others = np.setdiff1d(np.arange(n),rows)
+                rows = np.concatenate([rows,rng.choice(others,size=min(len(others), \
+                                       sample_size-len(rows)),replace=False)])
             else:
+                rows = np.arange(n)
+
+            medoids = self.swap_medoids(rng,arrays.subset(rows),
+                                        None if sampling else self.dissimilarities)
+            if medoids is None:
+                return False
 
-                 QgsMessageLog.logMessage(self.tr(
-                     "Link function invalid/not found"),
-                     MESSAGE_CATEGORY, Qgis.Critical)
-                 super().cancel()
+            # total deviation of all points from their closest medoid
+            medoids = rows[medoids]
+            labels,mindist = arrays.nearest(arrays.subset(medoids))
+            deviation = float(mindist.sum() if arrays.weights is None \
+                              else np.dot(arrays.weights,mindist))
+            if sampling:
+                QgsMessageLog.logMessage(self.tr("Sample {}: total deviation {:.5E}".format( \
+                    i+1,deviation)),MESSAGE_CATEGORY, Qgis.Info)
+            if best is None or deviation<best[0]:
+                best = (deviation,medoids,labels)
+
+        self.objective = best[0]
+        self.centers = arrays.subset(best[1])
+        self.clusters = arrays.groups(best[2],self.k)
+        return True
 
-            # delete deprecated clusters
-            del clust[ik]
-            del clust[jk]
-            
-            # display progress only at intervals of 5%
-            tree_progress = int(20*currentclustid/(self.k-numPoints))
-            if tree_progress > self.tree_progress:
-                self.tree_progress = tree_progress
-                QgsMessageLog.logMessage(self.tr("{}% of cluster tree built".format( \
-                                                 5*tree_progress)),MESSAGE_CATEGORY,
-                                                 Qgis.Info)
+    def medoid_sample_size(self, n):
+        """
+        Returns the size of the CLARA samples for n points or 0 if the
+        medoids are searched among all points (whose full dissimilarity
+        matrix must not exceed number_dense_medoid_points squared)
+        """
+        if 0 < self.sample_size < n:
+            return max(self.sample_size,2*self.k)
+        if n > number_dense_medoid_points:
+            return number_dense_medoid_points
+        return 0
+
+    def swap_medoids(self, rng, arrays, D=None):
+        """
+        Swap phase of FasterPAM from K-means++ seeds on the dissimilarities
+        of the points (D optionally holds them precomputed)
+        Returns the row indices of the medoids
+        """
+
+        if D is None:
+            D = arrays.cdist(arrays)
+        medoids = self.init_kmeans_plusplus(rng,arrays,sample_weights=arrays.weights)
+        if medoids is None:
+            return None
+
+        def callback():
+            return not self.isCanceled() and \
+                   (self.deadline is None or time() < self.deadline)
+
+        medoids,swaps,passes = fasterpam(D,medoids,arrays.weights,self.max_iter,callback)
+        if self.isCanceled():
+            return None
+        if self.deadline is not None and time() >= self.deadline:
+            QgsMessageLog.logMessage(self.tr("Time budget exhausted, "+ \
+                "keeping medoids after {} swaps".format(swaps)),
+                MESSAGE_CATEGORY, Qgis.Warning)
+        else:
+            QgsMessageLog.logMessage(self.tr("FasterPAM finished after {} swaps ".format(swaps)+ \
+                "in {} passes".format(passes)),MESSAGE_CATEGORY, Qgis.Info)
+        return medoids
+
+    def dbscan(self):
+        """
+        Density-based clustering with DBSCAN according to
+        Ester, M., Kriegel, H.-P., Sander, J. and Xu, X. (1996)
+        Neighbourhoods are searched in a uniform grid with cell size epsilon,
+        core points within epsilon of each other form the clusters and
+        border points join the cluster of their closest core point
+        """
 
-            # cluster ids that weren't in the original set are negative
-            currentclustid-=1
+        arrays = self.get_arrays()
+        n = len(arrays)
+        mass = np.ones(n) if arrays.weights is None else arrays.weights
+
+        eps = self.eps
+        if eps <= 0:
+            # about 90% of the sampled points shall become core points
+            rng = np.random.default_rng(self.seed)
+            sample = rng.choice(n,size=min(n,number_epsilon_samples),replace=False)
+            distance = arrays.subset(sample).k_nearest(arrays,min(self.min_points,n))[1]
+            eps = float(np.percentile(distance[:,-1],90))
+            QgsMessageLog.logMessage(self.tr("Neighbourhood radius epsilon "+ \
+                "estimated as {:.5E}".format(eps)),MESSAGE_CATEGORY, Qgis.Info)
+            if eps <= 0:
+                QgsMessageLog.logMessage(self.tr("Too little distinct points "+ \
+                    "to estimate epsilon"),MESSAGE_CATEGORY, Qgis.Critical)
+                return False
 
-        QgsMessageLog.logMessage(self.tr("Cluster tree fully computed"),
+        i,j,dist = arrays.grid_pairs(eps)
+        if self.isCanceled():
+            return False
+        QgsMessageLog.logMessage(self.tr("{} neighbour pairs found".format(len(i))),
             MESSAGE_CATEGORY, Qgis.Info)
 
-        self.clusters = [c.members for c in list(clust.values())]
+        # core points have enough points (or weight) within epsilon
+        core = np.bincount(i,weights=mass[j],minlength=n)>=self.min_points
+        labels = np.full(n,-1,dtype=np.intp)
+        edges = core[i]&core[j]
+        labels[core] = np.unique(connected_components(n,i[edges],j[edges])[core],
+                                 return_inverse=True)[1]
+
+        # border points join the cluster of the closest core point
+        border = ~core[i]&core[j]
+        i,j,dist = i[border],j[border],dist[border]
+        order = np.lexsort((dist,i))
+        first = np.unique(i[order],return_index=True)[1]
+        labels[i[order][first]] = labels[j[order][first]]
+
+        rows = np.flatnonzero(labels>=0)
+        self.clusters = [] if len(rows)==0 else \
+                        arrays.subset(rows).groups(labels[rows],int(labels.max())+1)
+        self.noise = [arrays.keys[row] for row in np.flatnonzero(labels<0)]
         return True
 
-    def hcluster_slink(self):
+    def cut(self, k):
+        """
+        Returns lists of point IDs per cluster after cutting the
+        cluster tree into k clusters
+        """
+        arrays = self.get_arrays()
+        return arrays.groups(cut_tree(len(arrays),self.merges,k),k)
 
-        def findClusterMembers(Pi,keys,ik,clusters):
-            members = []
-            for i in (i for i,jk in enumerate(Pi) if jk==ik):
-                if keys[i] not in [x for y in clusters for x in y]:
-                    members.append(keys[i])
-                members += findClusterMembers(Pi,keys,i,clusters)
-            return members
+    def spanning_tree(self):
+        """
+        Whether single linkage is derived from the Euclidean minimum
+        spanning tree (planar Euclidean distances without attributes)
+        """
+        return self.link=="single" and self.pa==0 and not self.manhattan and \
+               emst_available and ellipsoid_parameters(self.d)[0] is None
 
-        numPoints = len(self.points)
-        keys = list(self.points.keys())
-        Pi = [None]*numPoints
-        Lambda = [None]*numPoints
-        M = [None]*numPoints
-        iks = []
-        clusters = []
-        
-        # Initialize SLINK algorithm
-        Pi[0] = 0
-        Lambda[0] = float_info.max
-        cluster_sample=Cluster_node(d=self.d,pa=self.pa,manhattan=self.manhattan)
-        
-        # Iterate over vertices (called OTUs)
-        for i in range(1,numPoints):
-        
-            if self.isCanceled():
+    def aggregation(self, percentile):
+        """
+        Returns the cluster feature distance percentile of the BIRCH-like
+        preprocessing, 0 if exact single linkage of all points is derived
+        from the Euclidean minimum spanning tree in O(n log n) anyway
+        """
+        if self.connectivity == 0 and self.spanning_tree():
+            return 0
+        return percentile
+
+    def hcluster(self):
+        """
+        Agglomerative hierarchical clustering with Lance-Williams distance
+        updates on a condensed (or memory-mapped square) distance matrix, cluster members are
+        derived from the merges by union-find
+        Reducible linkages (single, complete, average and Ward's) use the
+        nearest-neighbor chain in O(n**2), centroid and median linkage the
+        generic algorithm with a heap of nearest-neighbor candidates,
+        planar single linkage the Euclidean minimum spanning tree,
+        with a connectivity graph only adjacent clusters are merged
+        """
+
+        arrays = self.get_arrays()
+        numPoints = len(arrays)
+
+        if numPoints==0:
+            QgsMessageLog.logMessage(self.tr("No points provided"),
+                MESSAGE_CATEGORY, Qgis.Critical)
+            return False
+
+        if self.link not in linkages:
+            QgsMessageLog.logMessage(self.tr(
+                "Link function invalid/not found"),
+                MESSAGE_CATEGORY, Qgis.Critical)
+            return False
+
+        if self.connectivity>0:
+            i,j = arrays.neighbour_graph(self.connectivity)
+            QgsMessageLog.logMessage(self.tr("Connectivity graph with {} edges".format( \
+                len(i))),MESSAGE_CATEGORY, Qgis.Info)
+            merges = graph_linkage(numPoints,i,j,arrays.row_distance(i,j),self.link,
+                                   arrays.weights,self.tree_callback(numPoints-1))
+            if merges is not None and numPoints-len(merges)>self.k:
+                QgsMessageLog.logMessage(self.tr("Connectivity graph splits the points "+ \
+                    "into {} components, increase the number of ".format(numPoints-len(merges))+ \
+                    "neighbours for {} clusters".format(self.k)),MESSAGE_CATEGORY, Qgis.Critical)
                 return False
-        
-            Pi[i] = i
-            Lambda[i] = float_info.max
-            M[:i] = [cluster_sample.getDistance(self.points[keys[p]],self.points[keys[i]]) \
-                     for p in range(i)]            
-            for p in range(i):
-                if Lambda[p]>=M[p]:
-                    M[Pi[p]] = min(M[Pi[p]],Lambda[p])
-                    Lambda[p] = M[p]
-                    Pi[p] = i
+        elif self.spanning_tree():
+            QgsMessageLog.logMessage(self.tr("Single linkage derived from the "+ \
+                "Euclidean minimum spanning tree"),MESSAGE_CATEGORY, Qgis.Info)
+            merges = emst_linkage(arrays.xy,arrays.weights)
+        else:
+            # condensed distances in memory or square distances (contiguous
+            # rows) in a file of the scratch folder
+            D,path = None,None
+            try:
+                if self.scratch:
+                    D,path = square_file(numPoints,self.scratch)
+                    QgsMessageLog.logMessage(self.tr("Distance matrix of {:.1f} GB ".format( \
+                        D.nbytes/2.**30)+"memory-mapped to {}".format(path)),
+                        MESSAGE_CATEGORY, Qgis.Info)
+                    arrays.cdist(arrays,D)
                 else:
-                    M[Pi[p]] = min(M[Pi[p]],M[p])
-            Pi[:i] = [x if Lambda[x]>Lambda[p] else i for p,x in enumerate(Pi[:i])]
-            
-            # display progress only at intervals of 5%
-            tree_progress = int(20*i/numPoints)
-            if tree_progress > self.tree_progress:
+                    D = arrays.condensed()
+                if self.isCanceled():
+                    return False
+
+                if self.link in reducible:
+                    merges = nn_chain(D,numPoints,self.link,arrays.weights,
+                                      self.tree_callback(numPoints-1))
+                else:
+                    merges = generic_linkage(D,numPoints,self.link,arrays.weights,1,
+                                             self.tree_callback(numPoints-1))
+            finally:
+                del D
+                if path is not None:
+                    remove(path)
+        if merges is None:
+            return False
+
+        if not self.quiet:
+            QgsMessageLog.logMessage(self.tr("Cluster tree fully computed"),
+                MESSAGE_CATEGORY, Qgis.Info)
+
+        self.merges = merges
+        self.clusters = self.cut(self.k)
+        return True
+
+    def tree_callback(self, total):
+        """
+        Returns a function reporting the progress of building the cluster
+        tree at intervals of 5% (unless quiet) which returns False once canceled
+        """
+        def callback(merges):
+            if self.isCanceled():
+                return False
+            tree_progress = int(20*merges/max(total,1))
+            if tree_progress > self.tree_progress and not self.quiet:
                 self.tree_progress = tree_progress
                 QgsMessageLog.logMessage(self.tr("{}% of cluster tree built".format( \
                                                  5*tree_progress)),MESSAGE_CATEGORY,
                                                  Qgis.Info)
+            return True
+        return callback
 
-        # Identify clusters in pointer representation
-        for clusterIndex in range(1,self.k):
-            closest = float_info.min
-            
-            for p in range(numPoints-1):
-                if Lambda[p]>closest:
-                    ik = p
-                    closest = Lambda[p]
-            Lambda[ik] = float_info.min
-            iks.append(ik)
-
-        iks.reverse()
-        
-        for ik in iks:
-            clusters.append([keys[ik]]+findClusterMembers(Pi,keys,ik,clusters))
-            
-        # assign remaining points to the last cluster
-        clusters.append([p for p in keys if p not in [x for y in clusters for x in y]])
+    def hcluster_slink(self):
+        """
+        Single linkage clustering with the SLINK algorithm on numpy arrays,
+        cluster members are derived from the pointer representation by
+        union-find leaving out the k-1 highest pointers
+        Given the pointer representation of the first points (self.pointer)
+        only the remaining points are inserted
+        """
 
-        #self.progress.setProgress(90)
-        QgsMessageLog.logMessage(self.tr("Cluster tree fully computed"),
-            MESSAGE_CATEGORY, Qgis.Info)
+        arrays = self.get_arrays()
+        numPoints = len(arrays)
+
+        if numPoints==0:
+            QgsMessageLog.logMessage(self.tr("No points provided"),
+                MESSAGE_CATEGORY, Qgis.Critical)
+            return False
+
+        # distances of point i to all previous points
+        def row(i):
+            return arrays.row_distance(np.full(i,i),np.arange(i))
+
+        if self.pointer is not None:
+            QgsMessageLog.logMessage(self.tr("Inserting {} points into the ".format( \
+                numPoints-len(self.pointer[0]))+"cluster tree of {} points".format( \
+                len(self.pointer[0]))),MESSAGE_CATEGORY, Qgis.Info)
+            pointer = slink(row,numPoints,*self.pointer,
+                            callback=self.tree_callback(numPoints))
+        else:
+            pointer = slink(row,numPoints,callback=self.tree_callback(numPoints))
+        if pointer is None:
+            return False
+
+        if not self.quiet:
+            QgsMessageLog.logMessage(self.tr("Cluster tree fully computed"),
+                MESSAGE_CATEGORY, Qgis.Info)
 
-        self.clusters = clusters
+        merges = pointer_linkage(*pointer,arrays.weights)
+        self.merges = merges
+        self.clusters = self.cut(self.k)
         return True
 
 
@@ -1016,64 +2372,6 @@ class KMCluster:
             dist = sqrt(dist)
         return dist
 
-class Cluster_node:
-    '''
-    Class for hierarchical clustering
-    '''
-    def __init__(self, members=[], d=None, pa=0, manhattan=False):
-        self.members = members
-        self.size = len(members)
-        self.d = d
-        self.pa = pa
-        self.manhattan = manhattan
-
-    def getDistance(self, point1, point2):
-        '''
-        2-dimensional Euclidean distance or Manhattan distance between points 1 and 2
-        plus percentage contribution (pa) of attribute values
-        '''
-        dist = 0
-        if self.manhattan:
-            if self.pa < 100:
-                dist += (1-0.01*self.pa)* \
-                    (self.d.measureLine(QgsPointXY(point1.x(),point1.y()), \
-                    QgsPointXY(point2.x(),point1.y()))+ \
-                    self.d.measureLine(QgsPointXY(point1.x(),point1.y()), \
-                    QgsPointXY(point1.x(),point2.y()))+ \
-                    self.d.measureLine(QgsPointXY(point2.x(),point2.y()), \
-                    QgsPointXY(point2.x(),point1.y()))+ \
-                    self.d.measureLine(QgsPointXY(point2.x(),point2.y()), \
-                    QgsPointXY(point1.x(),point2.y())))
-            if self.pa > 0:
-                dist += 2*0.01*self.pa*self.getAttrDistance(point1,point2)
-        else:
-            if self.pa < 100:
-                dist += (1-0.01*self.pa)* \
-                self.d.measureLine(QgsPointXY(point1.x(),point1.y()), \
-                QgsPointXY(point2.x(),point2.y()))
-            if self.pa > 0:
-                dist += 0.01*self.pa*self.getAttrDistance(point1,point2)
-        return dist
-                
-    def getAttrDistance(self, point1, point2):
-        '''
-        2-dimensional Euclidean distance or Manhattan distance between attributes
-        of points 1 and 2
-        '''
-        attr_size = min(point1.attr_size,point2.attr_size)
-        if attr_size == 0:
-            return 0
-        dist = 0
-        if self.manhattan:
-            for i in range(attr_size):
-                dist += abs(point1.attributes[i]-point2.attributes[i])
-        else:
-            for i in range(attr_size):
-                dist += (point1.attributes[i]-point2.attributes[i])* \
-                        (point1.attributes[i]-point2.attributes[i])
-            dist = sqrt(dist)
-        return dist
-
 class Cluster_point(QgsPoint):
     '''
     Class extends QgsPoint with attribute values
@@ -1082,6 +2380,7 @@ class Cluster_point(QgsPoint):
         super(Cluster_point, self).__init__(point)
         self.attr_size = 0
         self.attributes = []
+        self.weight = 1.0
     
     def addAttribute(self,v):
         self.attr_size += 1
@@ -1090,3 +2389,6 @@ class Cluster_point(QgsPoint):
     def replaceAttributes(self,v):
         self.attr_size = len(v)
         self.attributes = v
+
+    def setWeight(self,w):
+        self.weight = w
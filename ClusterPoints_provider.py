@@ -32,6 +32,8 @@ __revision__ = '$Format:%H$'
 
 from qgis.core import QgsProcessingProvider
 from .ClusterPoints_algorithm import ClusterPointsAlgorithm
+from .ClusterAssign_algorithm import ClusterAssignAlgorithm
+from .ClusterRecut_algorithm import ClusterRecutAlgorithm
 
 
 class ClusterPointsProvider(QgsProcessingProvider):
@@ -54,6 +56,8 @@ class ClusterPointsProvider(QgsProcessingProvider):
         Loads all algorithms belonging to this provider.
         """
         self.addAlgorithm(ClusterPointsAlgorithm())
+        self.addAlgorithm(ClusterAssignAlgorithm())
+        self.addAlgorithm(ClusterRecutAlgorithm())
         # add additional algorithms here
         # self.addAlgorithm(MyOtherAlgorithm())
 
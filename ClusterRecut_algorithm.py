@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ClusterPoints
+                                 A QGIS plugin
+ Cluster Points conducts spatial clustering of points based on their mutual distance to each other. The user can select between the K-Means algorithm and (agglomerative) hierarchical clustering with several different link functions.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2020-03-30
+        copyright            : (C) 2020 by Johannes Jenkner
+        email                : jjenkner@web.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Johannes Jenkner'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+
+
+from .cluster_hierarchy import cut_tree,parse_cluster_numbers
+
+from PyQt5.QtCore import QCoreApplication,QVariant
+
+from qgis.core import (QgsField,QgsFeatureRequest,QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterFile,QgsProcessingParameterNumber,
+                       QgsProcessingParameterString)
+
+from qgis.core import (QgsProcessing,QgsProcessingException,QgsProcessingAlgorithm,
+                      QgsProject)
+
+import numpy as np
+
+import json
+
+
+class ClusterRecutAlgorithm(QgsProcessingAlgorithm):
+    """
+    Relabels the points of a layer by cutting the dendrogram of a
+    hierarchical run written by doCluster without computing any distances
+    """
+
+    Points = 'Points'
+    Dendrogram = 'Dendrogram'
+    NumberOfClusters = 'NumberOfClusters'
+    ClusterNumbers = 'ClusterNumbers'
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.Points,
+            self.tr('Point layer clustered by doCluster'),
+            [QgsProcessing.TypeVectorPoint]))
+
+        self.addParameter(QgsProcessingParameterFile(
+            self.Dendrogram,
+            self.tr('Dendrogram file written by doCluster'),
+            extension='json'))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.NumberOfClusters,
+            self.tr('User-defined number of clusters'),
+            defaultValue=2,minValue=2,maxValue=999))
+
+        self.addParameter(QgsProcessingParameterString(
+            self.ClusterNumbers,
+            self.tr('Comma-separated numbers of clusters for additional cuts '+ \
+                    'written to fields Cluster_ID_k'),
+            optional=True))
+
+    def processAlgorithm(self, parameters, context, progress):
+
+        vlayer = self.parameterAsVectorLayer(parameters, self.Points, context)
+        Dendrogram = self.parameterAsFile(parameters, self.Dendrogram, context)
+        NumberOfClusters = self.parameterAsInt(parameters, self.NumberOfClusters, context)
+        ClusterNumbers = self.parameterAsString(parameters, self.ClusterNumbers, context)
+
+        try:
+            cuts = parse_cluster_numbers(ClusterNumbers or "")
+        except ValueError:
+            raise QgsProcessingException("Invalid list of numbers of clusters: "+ \
+                                         "{}".format(ClusterNumbers))
+
+        with open(Dendrogram) as f:
+            dendrogram = json.load(f)
+        for key in ("linkage","leaves","merges"):
+            if key not in dendrogram:
+                raise QgsProcessingException("Dendrogram file lacks entry {}".format(key))
+        leaves = dendrogram["leaves"]
+        merges = np.array(dendrogram["merges"],dtype=float).reshape(-1,4)
+        n = len(leaves)
+        for k in [NumberOfClusters]+cuts:
+            if k>n:
+                raise QgsProcessingException("Too little leaves in the dendrogram "+ \
+                                             "for {} clusters".format(k))
+            if n-k>len(merges):
+                raise QgsProcessingException("Dendrogram is not complete enough "+ \
+                                             "for {} clusters".format(k))
+        progress.pushInfo(self.tr("Cutting {} linkage dendrogram of {} leaves".format( \
+                                  dendrogram["linkage"],n)))
+
+        # copy layer
+        vlayer.selectAll()
+        vlayer_new = vlayer.materialize(QgsFeatureRequest().setFilterFids(vlayer.selectedFeatureIds()))
+        vlayer.removeSelection()
+
+        # add copied layer to canvas
+        QgsProject.instance().addMapLayer(vlayer_new)
+
+        # prepare output fields in new layer
+        names = ["Cluster_ID"]+["Cluster_ID_{}".format(k) for k in cuts]
+        progress.pushInfo(self.tr("Writing output fields {}".format(",".join(names))))
+        fieldList = vlayer_new.dataProvider().fields()
+        existing = [fieldList.indexFromName(name) for name in names \
+                    if name in [field.name() for field in fieldList]]
+        if existing:
+            vlayer_new.dataProvider().deleteAttributes(existing)
+        vlayer_new.dataProvider().addAttributes([QgsField(name,QVariant.Int) for name in names])
+        vlayer_new.updateFields()
+
+        # label the leaves of every cut and pass the labels on to their members
+        fieldList = vlayer_new.dataProvider().fields()
+        values = {}
+        for name,k in zip(names,[NumberOfClusters]+cuts):
+            icl = fieldList.indexFromName(name)
+            for leaf,label in zip(leaves,cut_tree(n,merges,k).tolist()):
+                for key in leaf:
+                    values.setdefault(key,{})[icl] = label
+        vlayer_new.dataProvider().changeAttributeValues(values)
+
+        progress.setProgress(100)
+
+        return {self.Points:"Cluster_ID"}
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'recutDendrogram'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr(self.name())
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'clustering'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ClusterRecutAlgorithm()
@@ -37,10 +37,15 @@ number_correction_trials = 25
 
 import random
 
+import numpy as np
+
+from .cluster_kernel import cluster_arrays
+
 from qgis.core import (QgsPoint,QgsPointXY,Qgis,QgsTask,QgsMessageLog)
 
 from math import floor,ceil,sqrt
 from sys import float_info
+from time import time
 
 MESSAGE_CATEGORY = 'ClusterPoints: Preparation'
 
@@ -48,7 +53,7 @@ MESSAGE_CATEGORY = 'ClusterPoints: Preparation'
 class CFTask(QgsTask):
     
     def __init__(self, description, data, agglomeration_percentile=0,
-                 d = None, pa = 0, manhattan = False):
+                 d = None, pa = 0, manhattan = False, deadline = None):
         super().__init__(description, QgsTask.CanCancel)
         self.__data = data
         self.__agglomeration_percentile = agglomeration_percentile
@@ -56,6 +61,7 @@ class CFTask(QgsTask):
         self.d = d
         self.pa = pa
         self.manhattan = manhattan
+        self.deadline = deadline
         self.size = 0
         
         self.result = None
@@ -96,15 +102,12 @@ class CFTask(QgsTask):
         else:
             subset = list(self.__data.keys())
         
-        # average pairwise distances
-        
-        sample_dist = [0]*int(0.5*(len(subset)*(len(subset)+1)))
+        # pairwise distances between all but the first sample point in parallel
+        # blocks, padded with the zeros of the first row and the self-distances
         
-        for i in range(len(subset)-1,0,-1):
-            ik = len(subset)-i
-            for j in range(i,len(subset)):
-                sample_dist[int(0.5*ik*(ik+1))+j] = \
-                       self.getDistance(self.__data[subset[i]],self.__data[subset[j]])
+        arrays = cluster_arrays(dict((key,self.__data[key]) for key in subset[1:]),
+                                self.d,self.pa,self.manhattan)
+        sample_dist = np.concatenate([np.zeros(max(2*len(subset)-1,0)),arrays.condensed()])
 
         # sort sample distances
 
@@ -155,6 +158,12 @@ class CFTask(QgsTask):
         '''
         blobs2consider = list(range(len(self.blobs)))
         for i in range(1,number_correction_trials+1):
+
+            if self.deadline is not None and time()>=self.deadline:
+                QgsMessageLog.logMessage(self.tr("Time budget exhausted after "+ \
+                        "{} iterations with {} cluster features ".format(i-1,len(blobs2consider))+ \
+                        "still to be re-checked"), MESSAGE_CATEGORY, Qgis.Warning)
+                return True
         
             blobsChanged = set()
             
@@ -220,53 +229,6 @@ class CFTask(QgsTask):
     
         return [p for b in [self.blobs[key].members for key in keys] for p in b]
 
-    def getDistance(self, point1, point2):
-        '''
-        2-dimensional Euclidean distance or Manhattan distance between points 1 and 2
-        plus percentage contribution (pa) of attribute values
-        '''
-        dist = 0
-        if self.manhattan:
-            if self.pa < 100:
-                dist += (1-0.01*self.pa)* \
-                    (self.d.measureLine(QgsPointXY(point1.x(),point1.y()), \
-                    QgsPointXY(point2.x(),point1.y()))+ \
-                    self.d.measureLine(QgsPointXY(point1.x(),point1.y()), \
-                    QgsPointXY(point1.x(),point2.y()))+ \
-                    self.d.measureLine(QgsPointXY(point2.x(),point2.y()), \
-                    QgsPointXY(point2.x(),point1.y()))+ \
-                    self.d.measureLine(QgsPointXY(point2.x(),point2.y()), \
-                    QgsPointXY(point1.x(),point2.y())))
-            if self.pa > 0:
-                dist += 2*0.01*self.pa*self.getAttrDistance(point1,point2)
-        else:
-            if self.pa < 100:
-                dist += (1-0.01*self.pa)* \
-                self.d.measureLine(QgsPointXY(point1.x(),point1.y()), \
-                QgsPointXY(point2.x(),point2.y()))
-            if self.pa > 0:
-                dist += 0.01*self.pa*self.getAttrDistance(point1,point2)
-        return dist
-                
-    def getAttrDistance(self, point1, point2):
-        '''
-        2-dimensional Euclidean distance or Manhattan distance between attributes
-        of points 1 and 2
-        '''
-        attr_size = min(point1.attr_size,point2.attr_size)
-        if attr_size == 0:
-            return 0
-        dist = 0
-        if self.manhattan:
-            for i in range(attr_size):
-                dist += abs(point1.attributes[i]-point2.attributes[i])
-        else:
-            for i in range(attr_size):
-                dist += (point1.attributes[i]-point2.attributes[i])* \
-                        (point1.attributes[i]-point2.attributes[i])
-            dist = sqrt(dist)
-        return dist
-
 
 class cf_blob:
 
@@ -286,30 +248,32 @@ class cf_blob:
         self.manhattan = manhattan
         self.members = members
         self.size = len(members)
-        self.centroid = centroid
+        self.weight = getattr(centroid,'weight',1.0)
+        self.centroid = Cluster_point(QgsPointXY(centroid.x(),centroid.y()))
+        self.centroid.replaceAttributes(list(centroid.attributes))
+        self.centroid.setWeight(self.weight)
         
     def update_centroid(self,point,remove=False):
         '''
-        Update the centroid position with one additional point being added or removed
+        Update the centroid position with one additional point being added or removed,
+        the point shifts the centroid according to its share of the blob weight
         '''
+        weight = getattr(point,'weight',1.0)
         if remove:
-            centroid = QgsPointXY(self.centroid.x()-(1.0/self.size)*(point.x()-self.centroid.x()), \
-                                  self.centroid.y()-(1.0/self.size)*(point.y()-self.centroid.y()))
+            share = -weight/(self.weight-weight)
+            self.weight -= weight
         else:
-            centroid = QgsPointXY(self.centroid.x()+(1.0/self.size)*(point.x()-self.centroid.x()), \
-                                  self.centroid.y()+(1.0/self.size)*(point.y()-self.centroid.y()))
+            self.weight += weight
+            share = weight/self.weight
+        centroid = QgsPointXY(self.centroid.x()+share*(point.x()-self.centroid.x()), \
+                              self.centroid.y()+share*(point.y()-self.centroid.y()))
         centroid = Cluster_point(centroid)
         
-        if remove:
-            centroid.replaceAttributes([self.centroid.attributes[j]- \
-                                        (1.0/self.size)*(point.attributes[j]- \
-                                        self.centroid.attributes[j]) for j in \
-                                        range(point.attr_size)])
-        else:
-            centroid.replaceAttributes([self.centroid.attributes[j]+ \
-                                        (1.0/self.size)*(point.attributes[j]- \
-                                        self.centroid.attributes[j]) for j in \
-                                        range(point.attr_size)])
+        centroid.replaceAttributes([self.centroid.attributes[j]+ \
+                                    share*(point.attributes[j]- \
+                                    self.centroid.attributes[j]) for j in \
+                                    range(point.attr_size)])
+        centroid.setWeight(self.weight)
         self.centroid = centroid
                
     def add_point(self,index,point):
@@ -380,6 +344,7 @@ class Cluster_point(QgsPoint):
         super(Cluster_point, self).__init__(point)
         self.attr_size = 0
         self.attributes = []
+        self.weight = 1.0
     
     def addAttribute(self,v):
         self.attr_size += 1
@@ -388,3 +353,6 @@ class Cluster_point(QgsPoint):
     def replaceAttributes(self,v):
         self.attr_size = len(v)
         self.attributes = v
+
+    def setWeight(self,w):
+        self.weight = w
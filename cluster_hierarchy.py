@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ClusterPoints
+                                 A QGIS plugin
+ Cluster Points conducts spatial clustering of points based on their mutual distance to each other. The user can select between the K-Means algorithm and (agglomerative) hierarchical clustering with several different link functions.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2020-03-30
+        copyright            : (C) 2020 by Johannes Jenkner
+        email                : jjenkner@web.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Johannes Jenkner'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+
+
+linkages = ("single","complete","median","average","wards","centroid")
+reducible = ("single","complete","average","wards")
+
+import numpy as np
+import heapq
+import os
+import tempfile
+
+try:
+    from scipy.spatial import Delaunay
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import minimum_spanning_tree
+except ImportError:
+    Delaunay = None
+
+emst_available = Delaunay is not None
+
+from .cluster_kernel import connected_components
+
+
+# Agglomerative clustering on a condensed distance matrix D holding the
+# distances of n points as upper triangle row by row (or on a square
+# matrix, where every row is one contiguous slice of a file). Clusters are
+# represented by one of their points (row), a merge table lists the
+# representative rows of both merged clusters, the merge height and
+# the size of the new cluster in the order of the merges.
+
+
+def condensed_index(n, i, j):
+    '''
+    Position of the distance between rows i and j (i != j) in D
+    '''
+    a = np.minimum(i,j)
+    b = np.maximum(i,j)
+    return n*a-a*(a+1)//2+b-a-1
+
+
+def square_file(n, folder):
+    '''
+    Square distance matrix of n points backed by a memory-mapped
+    temporary file in folder (row-major, so every row is read and written
+    as one contiguous slice), returns the array and the file path
+    (to be removed by the caller once the array is released)
+    '''
+    handle,path = tempfile.mkstemp(suffix=".dist",dir=folder)
+    os.close(handle)
+    D = np.memmap(path,dtype=float,mode='w+',shape=(max(n,1),max(n,1)))
+    return D,path
+
+
+def matrix_row(D, n, a, others):
+    '''
+    Distances between row a and the rows others of a condensed
+    or a square distance matrix D
+    '''
+    if D.ndim == 2:
+        return D[a,others]
+    return D[condensed_index(n,a,others)]
+
+
+def matrix_merge(D, n, link, i, j, others, dij, sizes):
+    '''
+    Replaces the distances between row i and the rows others by the
+    Lance-Williams distances of the union of clusters i and j, a square
+    matrix is kept symmetric by writing row i and then column i
+    (a sweep through the file in ascending order, but touching one page
+    per remaining row, so a file-backed matrix is only efficient if most
+    of it stays in the page cache)
+    '''
+    if D.ndim == 2:
+        new = linkage_update(link,D[i,others],D[j,others],dij,sizes[i],sizes[j],sizes[others])
+        D[i,others] = new
+        D[others,i] = new
+    else:
+        il = condensed_index(n,i,others)
+        jl = condensed_index(n,j,others)
+        D[il] = linkage_update(link,D[il],D[jl],dij,sizes[i],sizes[j],sizes[others])
+
+
+def linkage_update(link, dil, djl, dij, ni, nj, nl):
+    '''
+    Lance-Williams distances between the union of clusters i and j
+    and clusters l from the distances before the merge and the sizes
+    '''
+    if link == "single":
+        return np.minimum(dil,djl)
+    if link == "complete":
+        return np.maximum(dil,djl)
+    if link == "median":
+        return 0.5*dil+0.5*djl-0.25*dij
+    if link == "average":
+        return (ni*dil+nj*djl)/(ni+nj)
+    if link == "wards":
+        return ((ni+nl)*dil+(nj+nl)*djl-nl*dij)/(ni+nj+nl)
+    if link == "centroid":
+        return (ni*dil+nj*djl)/(ni+nj)-ni*nj*dij/(ni+nj)**2
+    raise ValueError("Link function {} not found".format(link))
+
+
+def generic_linkage(D, n, link, sizes=None, stop=1, callback=None):
+    '''
+    Generic algorithm according to Müllner, D. (2011): every row keeps a
+    candidate for its nearest neighbor among the later rows in a heap,
+    entries are checked lazily when they reach the top and the row is
+    rescanned if its candidate was retired or has moved away
+    (D is condensed or square and overwritten), callback(merges) returns False to cancel
+    Returns the same merge table as a scan for the closest pair before
+    every merge or None if canceled
+    '''
+    sizes = np.ones(n) if sizes is None else np.array(sizes,dtype=float)
+    active = np.ones(n,dtype=bool)
+    merges = np.empty((max(n-stop,0),4))
+    neighbor = np.zeros(n,dtype=np.intp)
+    mindist = np.full(n,np.inf)
+
+    def scan(i):
+        # nearest active neighbor of row i among the later rows
+        later = np.flatnonzero(active[i+1:])+i+1
+        if len(later) == 0:
+            mindist[i] = np.inf
+            return
+        distance = matrix_row(D,n,i,later)
+        m = int(np.argmin(distance))
+        neighbor[i],mindist[i] = later[m],distance[m]
+        heapq.heappush(heap,(mindist[i],i))
+
+    heap = []
+    for i in range(n-1):
+        scan(i)
+
+    step = 0
+    while step < n-stop:
+
+        d,i = heapq.heappop(heap)
+        if not active[i] or d != mindist[i]:
+            continue
+        j = neighbor[i]
+        if not active[j] or matrix_row(D,n,i,j) != d:
+            scan(i)
+            continue
+
+        # distances to all other active clusters in one expression
+        active[i] = active[j] = False
+        others = np.flatnonzero(active)
+        matrix_merge(D,n,link,i,j,others,d,sizes)
+        active[i] = True
+        mindist[j] = np.inf
+        sizes[i] += sizes[j]
+        merges[step] = (i,j,d,sizes[i])
+        step += 1
+
+        # earlier rows move their candidate to i if it came closer
+        earlier = others[others<i]
+        distance = matrix_row(D,n,i,earlier)
+        closer = distance<mindist[earlier]
+        for l,dl in zip(earlier[closer],distance[closer]):
+            neighbor[l],mindist[l] = i,dl
+            heapq.heappush(heap,(mindist[l],l))
+        scan(i)
+
+        if callback is not None and not callback(step):
+            return None
+
+    return merges
+
+
+def graph_linkage(n, i, j, dist, link, sizes=None, callback=None):
+    '''
+    Agglomerative clustering restricted to the edges (i,j) of a connectivity
+    graph with distances dist: only adjacent clusters are merged, distances
+    are kept for the edges of the merged graph in one dictionary per cluster
+    and the closest edge is taken from a heap (stale entries are skipped),
+    a cluster adjacent to only one of two merged clusters counts the known
+    distance for both, callback(merges) returns False to cancel
+    Returns the merge table until no edges are left or None if canceled
+    '''
+    size = [1.0]*n if sizes is None else [float(w) for w in sizes]
+    neighbors = [dict() for _ in range(n)]
+    for a,b,d in zip(i.tolist(),j.tolist(),dist.tolist()):
+        if a != b:
+            neighbors[a][b] = neighbors[b][a] = d
+    heap = [(d,a,b) for a in range(n) for b,d in neighbors[a].items() if a<b]
+    heapq.heapify(heap)
+    merges = []
+
+    while heap:
+
+        d,a,b = heapq.heappop(heap)
+        if neighbors[a].get(b) != d:
+            continue
+
+        # the cluster with more neighbors represents the union
+        if len(neighbors[a]) < len(neighbors[b]):
+            a,b = b,a
+        na,nb = neighbors[a],neighbors[b]
+        del na[b],nb[a]
+        for l in set(na)|set(nb):
+            dal = na.get(l,nb.get(l))
+            dbl = nb.get(l,dal)
+            new = float(linkage_update(link,dal,dbl,d,size[a],size[b],size[l]))
+            na[l] = new
+            nl = neighbors[l]
+            nl.pop(b,None)
+            nl[a] = new
+            heapq.heappush(heap,(new,min(a,l),max(a,l)))
+        neighbors[b] = {}
+        size[a] += size[b]
+        merges.append((a,b,d,size[a]))
+
+        if callback is not None and not callback(len(merges)):
+            return None
+
+    return np.array(merges,dtype=float).reshape(-1,4)
+
+
+def nn_chain(D, n, link, sizes=None, callback=None):
+    '''
+    Nearest-neighbor-chain algorithm for reducible linkages according to
+    Murtagh, F. (1983): a chain of nearest neighbors is followed until two
+    clusters are mutual nearest neighbors, which are merged at once
+    (D is condensed or square and overwritten), callback(merges) returns False to cancel
+    Returns the full merge table sorted by height or None if canceled
+    '''
+    if link not in reducible:
+        raise ValueError("Link function {} is not reducible".format(link))
+    sizes = np.ones(n) if sizes is None else np.array(sizes,dtype=float)
+    active = np.ones(n,dtype=bool)
+    merges = np.empty((max(n-1,0),4))
+    chain = []
+
+    for step in range(n-1):
+
+        if len(chain) == 0:
+            chain.append(int(np.argmax(active)))
+
+        while True:
+            a = chain[-1]
+            active[a] = False
+            others = np.flatnonzero(active)
+            active[a] = True
+            distance = matrix_row(D,n,a,others)
+            b = int(others[np.argmin(distance)])
+            # prefer the predecessor in the chain on ties
+            if len(chain) > 1 and matrix_row(D,n,a,chain[-2]) <= distance.min():
+                b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]:
+                break
+            chain.append(b)
+
+        # merge the mutual nearest neighbors a and b
+        chain = chain[:-2]
+        i,j = min(a,b),max(a,b)
+        height = matrix_row(D,n,i,j)
+        active[i] = active[j] = False
+        others = np.flatnonzero(active)
+        matrix_merge(D,n,link,i,j,others,height,sizes)
+        active[i] = True
+        sizes[i] += sizes[j]
+        merges[step] = (i,j,height,sizes[i])
+
+        if callback is not None and not callback(step+1):
+            return None
+
+    return merges[np.argsort(merges[:,2],kind='stable')]
+
+
+def emst_linkage(xy, sizes=None):
+    '''
+    Single linkage of planar points from their Euclidean minimum spanning
+    tree, which is a subgraph of the Delaunay triangulation (scipy)
+    Returns the merge table with the spanning tree edges sorted by length
+    or None if scipy is not available
+    '''
+    if not emst_available:
+        return None
+    n = len(xy)
+    try:
+        tri = Delaunay(xy)
+    except (RuntimeError,ValueError):
+        # collinear points or too few points for a triangulation
+        axis = np.argmax(np.ptp(xy,axis=0)) if n>0 else 0
+        order = np.argsort(xy[:,axis],kind='stable')
+        i,j = order[:-1],order[1:]
+    else:
+        # triangle edges plus coincident points left out of the triangulation
+        i = np.concatenate([tri.simplices.ravel(),tri.coplanar[:,0]])
+        j = np.concatenate([np.roll(tri.simplices,1,axis=1).ravel(),tri.coplanar[:,2]])
+        codes = np.unique(np.minimum(i,j).astype(np.int64)*n+np.maximum(i,j))
+        i,j = codes//n,codes%n
+        length = np.hypot(*(xy[i]-xy[j]).T)
+        # zero lengths count as missing edges for minimum_spanning_tree
+        tree = minimum_spanning_tree(coo_matrix((np.maximum(length,np.finfo(float).tiny),
+                                                 (i,j)),shape=(n,n))).tocoo()
+        i,j = tree.row,tree.col
+    return tree_linkage(n,i,j,np.hypot(*(xy[i]-xy[j]).T),sizes)
+
+
+def slink(row, n, Pi=None, Lambda=None, callback=None):
+    '''
+    SLINK algorithm according to Sibson, R. (1973) inserting one point
+    after another into the pointer representation (Pi,Lambda) of the single
+    linkage dendrogram, row(i) returns the distances of point i to the
+    points 0,...,i-1, the pointer representation of the first points can
+    be passed to insert the remaining ones, callback(i) returns False to cancel
+    Returns Pi and Lambda or None if canceled
+    '''
+    start = 0 if Pi is None else len(Pi)
+    pointer = np.empty(n,dtype=np.intp)
+    height = np.empty(n)
+    M = np.empty(n)
+    if start > 0:
+        pointer[:start] = Pi
+        height[:start] = Lambda
+
+    for i in range(start,n):
+
+        pointer[i] = i
+        height[i] = np.inf
+        pi,lam,m = pointer[:i],height[:i],M[:i]
+        m[:] = row(i)
+
+        # pass the distances on along the pointers as long as they decrease
+        changed = np.arange(i)
+        while len(changed) > 0:
+            parents = pi[changed]
+            before = m[parents]
+            np.minimum.at(m,parents,np.maximum(lam[changed],m[changed]))
+            changed = np.unique(parents[m[parents]<before])
+
+        closer = m<=lam
+        lam[closer] = m[closer]
+        pi[closer] = i
+        pi[height[pi]<=lam] = i
+
+        if callback is not None and not callback(i+1):
+            return None
+
+    return pointer,height
+
+
+def pointer_linkage(Pi, Lambda, sizes=None):
+    '''
+    Merge table of the single linkage dendrogram in pointer representation
+    '''
+    i = np.flatnonzero(np.isfinite(Lambda))
+    return tree_linkage(len(Pi),i,Pi[i],Lambda[i],sizes)
+
+
+def linkage_pointer(n, merges):
+    '''
+    Pointer representation (Pi,Lambda) of a single linkage merge table:
+    at every merge the last point of one cluster points to the later
+    last point of the other cluster from the merge height on
+    '''
+    parent = list(range(n))
+    last = list(range(n))
+    Pi = np.arange(n)
+    Lambda = np.full(n,np.inf)
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+    for a,b,height in merges[:,:3].tolist():
+        a,b = find(int(a)),find(int(b))
+        low,high = sorted((last[a],last[b]))
+        Pi[low] = high
+        Lambda[low] = height
+        parent[b] = a
+        last[a] = high
+    return Pi,Lambda
+
+
+def tree_linkage(n, i, j, heights, sizes=None):
+    '''
+    Merge table of single linkage from the edges (i,j) of a spanning
+    tree of the n points sorted by their heights, the cluster sizes
+    are counted by union-find along the sorted edges
+    '''
+    order = np.argsort(heights,kind='stable')
+    i,j,heights = i[order],j[order],heights[order]
+    parent = list(range(n))
+    size = [1.0]*n if sizes is None else [float(w) for w in sizes]
+    merged = np.empty(len(i))
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+    for step,(a,b) in enumerate(zip(i.tolist(),j.tolist())):
+        a,b = find(a),find(b)
+        parent[b] = a
+        size[a] += size[b]
+        merged[step] = size[a]
+    return np.column_stack([i,j,heights,merged])
+
+
+def cut_tree(n, merges, k):
+    '''
+    Cluster labels of the n points after the first n-k merges
+    (union-find over the merged representative rows)
+    '''
+    merged = merges[:n-k]
+    return connected_components(n,merged[:,0].astype(np.intp),merged[:,1].astype(np.intp))
+
+
+def parse_cluster_numbers(text):
+    '''
+    Sorted distinct numbers of clusters from a comma-separated list,
+    raises ValueError for entries which are no numbers larger than 1
+    '''
+    numbers = [int(k) for k in text.replace(";",",").split(",") if k.strip()]
+    if any(k<2 for k in numbers):
+        raise ValueError("Numbers of clusters must be larger than 1")
+    return sorted(set(numbers))
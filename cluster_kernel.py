@@ -0,0 +1,751 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ClusterPoints
+                                 A QGIS plugin
+ Cluster Points conducts spatial clustering of points based on their mutual distance to each other. The user can select between the K-Means algorithm and (agglomerative) hierarchical clustering with several different link functions.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2020-03-30
+        copyright            : (C) 2020 by Johannes Jenkner
+        email                : jjenkner@web.de
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Johannes Jenkner'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+
+
+block_elements = 2**22
+number_workers = None
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from os import cpu_count
+from threading import local
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+from qgis.core import (QgsPointXY,QgsCoordinateTransform,QgsProject)
+
+
+def cluster_arrays(points, d, pa=0, manhattan=False):
+    '''
+    Converts a dictionary of Cluster_point objects into columnar arrays
+    sharing the distance definition of the QgsDistanceArea object d
+    '''
+    keys = list(points.keys())
+    xy = np.array([[points[key].x(),points[key].y()] for key in keys],
+                  dtype=float).reshape(len(keys),2)
+    attr_size = min([points[key].attr_size for key in keys]) if keys else 0
+    attributes = np.array([points[key].attributes[:attr_size] for key in keys],
+                          dtype=float).reshape(len(keys),attr_size)
+    weights = np.array([getattr(points[key],'weight',1.0) for key in keys],dtype=float)
+    if np.all(weights==1):
+        weights = None
+
+    return ClusterArrays(keys,xy,attributes,pa,manhattan,*ellipsoid_parameters(d),
+                         weights=weights)
+
+
+def centroid_model(centers, fields, attr_centers, standard_factor, pa=0, manhattan=False):
+    '''
+    Model entries of the final centroids with raw attribute values and
+    the distance definition needed to assign new points
+    '''
+    return {"distance_type":"Manhattan" if manhattan else "Euclidean",
+            "percent_attrib":pa,
+            "fields":list(fields),
+            "attr_centers":[float(a) for a in attr_centers],
+            "standard_factor":float(standard_factor),
+            "centroids":[[float(x),float(y)]+[float(a/standard_factor+attr_centers[j]) \
+                         for j,a in enumerate(attributes)] for (x,y),attributes in \
+                         zip(centers.xy,centers.attributes)]}
+
+
+def model_labels(model, keys, xy, attributes, ellipsoid=None, geographic=None):
+    '''
+    Labels of the nearest model centroids for points with coordinates xy
+    in the model CRS and raw attribute values of the model fields
+    (standardized as in the fitted model)
+    '''
+    fields = model["fields"]
+    pa = model["percent_attrib"] if len(fields)>0 else 0
+    attr_centers = np.array(model["attr_centers"],dtype=float)
+    standard_factor = model["standard_factor"]
+    attributes = (np.array(attributes,dtype=float).reshape(len(keys),len(fields))- \
+                  attr_centers)*standard_factor
+    centroids = np.array(model["centroids"],dtype=float).reshape(-1,2+len(fields))
+
+    # label all points in one nearest-centroid pass
+    arrays = ClusterArrays(keys,np.array(xy,dtype=float).reshape(len(keys),2),
+                           attributes,pa,model["distance_type"]=="Manhattan",
+                           ellipsoid,geographic)
+    centers = arrays.centers(centroids[:,:2],(centroids[:,2:]-attr_centers)*standard_factor)
+    return arrays.nearest(centers)[0]
+
+
+def ellipsoid_parameters(d):
+    '''
+    Returns the ellipsoid (semi-major axis, flattening) of the QgsDistanceArea
+    object d and a function converting layer coordinates to radians on it,
+    or None twice for planar distances
+    '''
+    if d is None or not d.willUseEllipsoid():
+        return None,None
+    ellipsoid = (d.ellipsoidSemiMajor(),1.0/d.ellipsoidInverseFlattening())
+    transform = QgsCoordinateTransform(d.sourceCrs(),d.ellipsoidCrs(),
+                                       QgsProject.instance())
+    def geographic(xy):
+        lonlat = [transform.transform(QgsPointXY(x,y)) for x,y in xy]
+        return np.radians(np.array([[p.x(),p.y()] for p in lonlat],
+                                   dtype=float).reshape(len(lonlat),2))
+    return ellipsoid,geographic
+
+
+def geodesic(lon1, lat1, lon2, lat2, a, f):
+    '''
+    Vectorized ellipsoidal distance (Lambert's formula) between positions
+    given in radians, accurate to a few meters over continental distances
+    '''
+    beta1 = np.arctan((1-f)*np.tan(lat1))
+    beta2 = np.arctan((1-f)*np.tan(lat2))
+    h = np.sin(0.5*(beta2-beta1))**2+ \
+        np.cos(beta1)*np.cos(beta2)*np.sin(0.5*(lon2-lon1))**2
+    sigma = 2*np.arcsin(np.sqrt(np.clip(h,0,1)))
+    sin_p2 = np.sin(0.5*(beta1+beta2))**2
+    sin_q2 = np.sin(0.5*(beta2-beta1))**2
+    with np.errstate(divide='ignore',invalid='ignore'):
+        x = (sigma-np.sin(sigma))*sin_p2*(1-sin_q2)/np.cos(0.5*sigma)**2
+        y = (sigma+np.sin(sigma))*(1-sin_p2)*sin_q2/np.sin(0.5*sigma)**2
+    correction = np.where(np.isfinite(x),x,0)+np.where(np.isfinite(y),y,0)
+    return a*(sigma-0.5*f*correction)
+
+
+budget = local()
+
+
+def worker_budget():
+    '''
+    Returns the number of worker threads the calling thread may use
+    (its share of the budget of an enclosing pool or all processors)
+    '''
+    return getattr(budget,"workers",None) or number_workers or cpu_count() or 1
+
+
+def parallel_map(func, items):
+    '''
+    Applies func to every item using a pool of worker threads within the
+    budget of the calling thread, the budget is shared among the workers
+    so that nested pools do not oversubscribe the processors
+    '''
+    items = list(items)
+    workers = min(worker_budget(),len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    share = max(1,worker_budget()//workers)
+
+    def run(item):
+        budget.workers = share
+        return func(item)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run,items))
+
+
+def parallel_blocks(func, n, block):
+    '''
+    Applies func(start,stop) to consecutive row blocks of size block
+    using a pool of worker threads (numpy releases the GIL)
+    '''
+    bounds = [(start,min(start+block,n)) for start in range(0,n,block)]
+    return parallel_map(lambda b: func(*b),bounds)
+
+
+def connected_components(n, i, j):
+    '''
+    Labels the connected components of the graph with n nodes and edges (i,j)
+    by repeated hooking of roots to the lowest neighbouring root and
+    pointer jumping, returns labels numbered from 0
+    '''
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[i],labels[j])
+        roots = labels.copy()
+        np.minimum.at(roots,labels[i],low)
+        np.minimum.at(roots,labels[j],low)
+        jumped = roots[roots]
+        while not np.array_equal(jumped,roots):
+            roots = jumped
+            jumped = roots[roots]
+        if np.array_equal(roots,labels):
+            break
+        labels = roots
+    return np.unique(labels,return_inverse=True)[1]
+
+
+def fasterpam(D, medoids, mass=None, max_iter=100, callback=None):
+    '''
+    Eager swap phase of FasterPAM according to Schubert, E. and
+    Rousseeuw, P. J. (2021) on the (n,n) dissimilarities D starting from
+    the medoid rows: all k possible swaps of a candidate are evaluated in a
+    single pass over the points, after a swap the nearest and second nearest
+    medoids are updated in O(n) and only points which lost their second
+    nearest medoid are compared with all medoids again,
+    callback() returns False to stop early
+    Returns the medoid rows, the number of swaps and the number of passes
+    '''
+    n = len(D)
+    k = len(medoids)
+    mass = np.ones(n) if mass is None else mass
+    medoids = np.array(medoids,dtype=np.intp)
+    is_medoid = np.zeros(n,dtype=bool)
+    is_medoid[medoids] = True
+    nearest = np.zeros(n,dtype=np.intp)
+    second = np.zeros(n,dtype=np.intp)
+    dnear = np.empty(n)
+    dsecond = np.empty(n)
+
+    def rescan(rows, both):
+        # nearest (optionally) and second nearest medoid of the rows
+        dm = D[np.ix_(rows,medoids)]
+        points = np.arange(len(rows))
+        if both:
+            nearest[rows] = np.argmin(dm,axis=1)
+            dnear[rows] = dm[points,nearest[rows]]
+        dm[points,nearest[rows]] = np.inf
+        second[rows] = np.argmin(dm,axis=1)
+        dsecond[rows] = dm[points,second[rows]]
+
+    rescan(np.arange(n),True)
+    # loss of removing each medoid
+    removal = np.bincount(nearest,weights=mass*(dsecond-dnear),minlength=k)
+    last = None
+    swaps = 0
+    for passes in range(1,max_iter+1):
+        for x in range(n):
+            if x == last:
+                break
+            if is_medoid[x]:
+                continue
+            if callback is not None and not callback():
+                return medoids,swaps,passes
+            dx = D[:,x]
+            closer = dx<dnear
+            between = ~closer & (dx<dsecond)
+            # gain of x as new nearest medoid plus change of removal losses
+            gain = float(np.dot(mass[closer],dx[closer]-dnear[closer]))
+            delta = removal+ \
+                    np.bincount(nearest[closer],weights=mass[closer]* \
+                                (dnear[closer]-dsecond[closer]),minlength=k)+ \
+                    np.bincount(nearest[between],weights=mass[between]* \
+                                (dx[between]-dsecond[between]),minlength=k)
+            i = int(np.argmin(delta))
+            if delta[i]+gain >= -1.e6*np.finfo(float).eps:
+                continue
+
+            # x replaces the medoid in slot i
+            is_medoid[medoids[i]] = False
+            is_medoid[x] = True
+            medoids[i] = x
+            lost = nearest==i
+            # points losing their nearest medoid keep x or move to the second
+            keep = lost & (dx<=dsecond)
+            move = lost & ~keep
+            # x becomes the nearest or second nearest medoid of other points
+            first = ~lost & closer
+            replaced = ~lost & ~closer & (second==i)
+            runner_up = ~lost & ~closer & (dx<dsecond)
+            rows = np.flatnonzero(move|(replaced&~runner_up))
+            dnear[keep] = dx[keep]
+            nearest[move],dnear[move] = second[move],dsecond[move]
+            second[first],dsecond[first] = nearest[first],dnear[first]
+            nearest[first],dnear[first] = i,dx[first]
+            second[runner_up],dsecond[runner_up] = i,dx[runner_up]
+            if len(rows):
+                rescan(rows,False)
+            removal = np.bincount(nearest,weights=mass*(dsecond-dnear),minlength=k)
+            last = x
+            swaps += 1
+        else:
+            if last is not None:
+                continue
+        break
+    return medoids,swaps,passes
+
+
+def cluster_metrics(arrays, labels, k, sample_size=0, rng=None):
+    '''
+    Returns quality metrics of the clusters given by labels measured with
+    the combined distance to the (weighted) cluster means: sizes, inertia
+    per cluster, sum of squared errors, Calinski-Harabasz index,
+    Davies-Bouldin index, simplified silhouette and the exact silhouette
+    of up to sample_size randomly drawn points (None for sample_size 0)
+    '''
+    n = len(arrays)
+    mass = np.ones(n) if arrays.weights is None else arrays.weights
+    total = mass.sum()
+    centers = arrays.means(labels,k,arrays.weights)
+    sizes = np.bincount(labels,weights=mass,minlength=k)
+
+    # distances to the own and to the closest other cluster center
+    own = arrays.paired_distance(centers.subset(labels))
+    index,distance = arrays.k_nearest(centers,2)
+    other = np.where(index[:,0]==labels,distance[:,1],distance[:,0])
+
+    inertia = np.bincount(labels,weights=mass*own*own,minlength=k)
+    sse = float(inertia.sum())
+    root = arrays.means(np.zeros(n,dtype=np.intp),1,arrays.weights)
+    between = float(np.dot(sizes,centers.cdist(root)[:,0]**2))
+    if sse > 0 and total > k:
+        calinski_harabasz = between/(k-1)/(sse/(total-k))
+    else:
+        calinski_harabasz = float('inf')
+
+    # scatter within clusters relative to the separation of cluster centers
+    scatter = np.bincount(labels,weights=mass*own,minlength=k)/sizes
+    separation = centers.cdist(centers)
+    np.fill_diagonal(separation,np.inf)
+    davies_bouldin = float(np.mean(np.max((scatter[:,None]+scatter[None,:])/separation,axis=1)))
+
+    largest = np.maximum(own,other)
+    silhouette = np.divide(other-own,largest,out=np.zeros(n),where=largest>0)
+
+    metrics = {"sizes":sizes.tolist(),
+               "inertia":inertia.tolist(),
+               "sse":sse,
+               "calinski_harabasz":float(calinski_harabasz),
+               "davies_bouldin":davies_bouldin,
+               "simplified_silhouette":float(np.dot(mass,silhouette)/total),
+               "silhouette":None}
+    if sample_size > 0:
+        metrics["silhouette"] = sampled_silhouette(arrays,labels,k,sample_size,rng)
+    return metrics
+
+
+def cluster_scores(arrays, labels, k):
+    '''
+    Returns the sum of squared errors, the Calinski-Harabasz index and
+    the simplified silhouette of the clusters given by labels
+    '''
+    metrics = cluster_metrics(arrays,labels,k)
+    return metrics["sse"],metrics["calinski_harabasz"],metrics["simplified_silhouette"]
+
+
+def sampled_silhouette(arrays, labels, k, sample_size, rng=None):
+    '''
+    Returns the (weighted) mean silhouette according to Rousseeuw, P. J. (1987)
+    of up to sample_size randomly drawn points, each compared against all points
+    '''
+    n = len(arrays)
+    mass = np.ones(n) if arrays.weights is None else arrays.weights
+    if rng is None:
+        rng = np.random.default_rng()
+    sample = np.arange(n) if sample_size >= n else \
+             np.sort(rng.choice(n,size=sample_size,replace=False))
+
+    # distance sums per cluster of points sorted by label
+    order = np.argsort(labels,kind='stable')
+    sizes = np.bincount(labels,weights=mass,minlength=k)
+    counts = np.bincount(labels,minlength=k)
+    filled = counts>0
+    bounds = np.concatenate([[0],np.cumsum(counts)[:-1]])[filled]
+    points = arrays.subset(order)
+    sampled = arrays.subset(sample)
+    silhouette = np.empty(len(sample))
+
+    def fill(start,stop):
+        dist = sampled.block_distance(points,slice(start,stop))*mass[order]
+        # empty clusters do not count as nearest other cluster
+        sums = np.full((stop-start,k),np.inf)
+        sums[:,filled] = np.add.reduceat(dist,bounds,axis=1)
+        own = labels[sample[start:stop]]
+        rows = np.arange(stop-start)
+        remaining = sizes[own]-mass[sample[start:stop]]
+        a = np.divide(sums[rows,own],remaining,out=np.zeros(stop-start),where=remaining>0)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            means = sums/sizes
+        means[rows,own] = np.inf
+        b = means.min(axis=1)
+        largest = np.maximum(a,b)
+        # points alone in their cluster get zero silhouette
+        silhouette[start:stop] = np.where(remaining>0,np.divide(b-a,largest, \
+                                 out=np.zeros(stop-start),where=largest>0),0)
+
+    parallel_blocks(fill,len(sample),sampled.block_size(n))
+    return float(np.dot(mass[sample],silhouette)/mass[sample].sum())
+
+
+class ClusterArrays:
+    '''
+    Columnar representation of cluster points together with the distance
+    definition (Euclidean or Manhattan plus attribute contribution)
+    '''
+    def __init__(self, keys, xy, attributes, pa=0, manhattan=False,
+                 ellipsoid=None, geographic=None, geo=None, weights=None):
+        '''
+        keys - list of point IDs in row order
+        xy - (n,2) array of layer coordinates
+        attributes - (n,a) array of standardised attribute values
+        pa - percentage contribution of the attribute values
+        manhattan - whether to use the Manhattan distance
+        ellipsoid - tuple (semi-major axis, flattening) or None for planar distances
+        geographic - function converting layer coordinates to radians on the ellipsoid
+        geo - precomputed (n,2) array of longitudes/latitudes in radians
+        weights - (n,) array of point weights or None for unit weights
+        '''
+        self.keys = keys
+        self.xy = xy
+        self.attributes = attributes
+        self.pa = pa
+        self.manhattan = manhattan
+        self.ellipsoid = ellipsoid
+        self.geographic = geographic
+        if ellipsoid is not None and geo is None:
+            geo = geographic(xy)
+        self.geo = geo
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.xy)
+
+    @property
+    def attr_size(self):
+        return self.attributes.shape[1]
+
+    def total_weight(self):
+        '''
+        Sum of the point weights
+        '''
+        return float(len(self) if self.weights is None else self.weights.sum())
+
+    def subset(self, rows):
+        '''
+        Returns the points in the given rows sharing the distance definition
+        '''
+        rows = np.asarray(rows,dtype=np.intp)
+        return ClusterArrays([self.keys[i] for i in rows],self.xy[rows],
+                             self.attributes[rows],self.pa,self.manhattan,
+                             self.ellipsoid,self.geographic,
+                             None if self.geo is None else self.geo[rows],
+                             None if self.weights is None else self.weights[rows])
+
+    def centers(self, xy, attributes):
+        '''
+        Returns cluster centers with the given coordinates and attributes
+        '''
+        xy = np.asarray(xy,dtype=float).reshape(-1,2)
+        attributes = np.asarray(attributes,dtype=float).reshape(len(xy),-1)
+        return ClusterArrays(list(range(len(xy))),xy,attributes,self.pa,
+                             self.manhattan,self.ellipsoid,self.geographic)
+
+    def distance(self, xy1, geo1, attr1, xy2, geo2, attr2):
+        '''
+        Elementwise (broadcast) combined distance between coordinates xy,
+        positions geo in radians and attribute values attr
+        '''
+        dist = 0
+        if self.pa < 100:
+            if self.ellipsoid is None:
+                dx = np.abs(xy1[...,0]-xy2[...,0])
+                dy = np.abs(xy1[...,1]-xy2[...,1])
+                if self.manhattan:
+                    location = 2*(dx+dy)
+                else:
+                    location = np.hypot(dx,dy)
+            else:
+                a,f = self.ellipsoid
+                lon1,lat1 = geo1[...,0],geo1[...,1]
+                lon2,lat2 = geo2[...,0],geo2[...,1]
+                if self.manhattan:
+                    # legs along meridians and parallels in both directions
+                    location = geodesic(lon1,lat1,lon2,lat1,a,f)+ \
+                               geodesic(lon1,lat1,lon1,lat2,a,f)+ \
+                               geodesic(lon2,lat2,lon2,lat1,a,f)+ \
+                               geodesic(lon2,lat2,lon1,lat2,a,f)
+                else:
+                    location = geodesic(lon1,lat1,lon2,lat2,a,f)
+            dist = dist+(1-0.01*self.pa)*location
+        if self.pa > 0:
+            attr_size = min(attr1.shape[-1],attr2.shape[-1])
+            diff = attr1[...,:attr_size]-attr2[...,:attr_size]
+            if self.manhattan:
+                dist = dist+2*0.01*self.pa*np.abs(diff).sum(axis=-1)
+            else:
+                dist = dist+0.01*self.pa*np.sqrt(np.einsum('...k,...k->...',diff,diff))
+        return dist
+
+    def block_distance(self, other, rows=slice(None)):
+        '''
+        Combined distance between selected rows and all points of other
+        '''
+        geo1 = None if self.geo is None else self.geo[rows,None,:]
+        geo2 = None if other.geo is None else other.geo[None,:,:]
+        return self.distance(self.xy[rows,None,:],geo1,self.attributes[rows,None,:],
+                             other.xy[None,:,:],geo2,other.attributes[None,:,:])
+
+    def paired_distance(self, other):
+        '''
+        Combined distance between corresponding rows of self and other
+        '''
+        return self.distance(self.xy,self.geo,self.attributes,
+                             other.xy,other.geo,other.attributes)
+
+    def block_size(self, m):
+        '''
+        Number of rows per block when comparing against m points
+        '''
+        return max(1,block_elements//(max(m,1)*(self.attr_size+4)))
+
+    def row_distance(self, rows1, rows2):
+        '''
+        Combined distance between the points in rows1 and rows2 pairwise
+        '''
+        geo1 = None if self.geo is None else self.geo[rows1]
+        geo2 = None if self.geo is None else self.geo[rows2]
+        return self.distance(self.xy[rows1],geo1,self.attributes[rows1],
+                             self.xy[rows2],geo2,self.attributes[rows2])
+
+    def grid_coordinates(self):
+        '''
+        Returns coordinates whose maximum norm difference never exceeds
+        the combined distance of two points (bound for grid searches)
+        '''
+        w = 0.01*self.pa
+        scale = 2 if self.manhattan else 1
+        if self.pa < 100:
+            if self.ellipsoid is None:
+                return scale*(1-w)*self.xy
+            # Cartesian coordinates on the ellipsoid (chords never exceed geodesics)
+            a,f = self.ellipsoid
+            e2 = f*(2-f)
+            lon,lat = self.geo[:,0],self.geo[:,1]
+            N = a/np.sqrt(1-e2*np.sin(lat)**2)
+            ecef = np.column_stack([N*np.cos(lat)*np.cos(lon),N*np.cos(lat)*np.sin(lon),
+                                    N*(1-e2)*np.sin(lat)])
+            # margin for the approximation of geodesic distances
+            return 0.999*scale*(1-w)*ecef
+        return scale*w*self.attributes[:,:3]
+
+    def grid_pairs(self, eps):
+        '''
+        Returns all pairs of rows (i,j) within distance eps (both orders
+        and i==j included) and their distances, comparing only points in
+        neighbouring cells of a uniform grid with cell size eps
+        '''
+        coords = self.grid_coordinates()
+        dims = coords.shape[1]
+        low = coords.min(axis=0)
+        size = eps
+        # coarsen the grid until the cell numbers fit into 63 bits
+        while True:
+            cells = np.floor((coords-low)/size).astype(np.int64)+1
+            extent = cells.max(axis=0)+2
+            if np.prod(extent.astype(float)) < 2.**62:
+                break
+            size *= 2
+        radix = np.cumprod(np.concatenate([[1],extent[:-1]])).astype(np.int64)
+        codes = cells@radix
+        order = np.argsort(codes,kind='stable')
+        unique,starts,counts = np.unique(codes[order],return_index=True,return_counts=True)
+
+        def pairs(a, b):
+            # all pairs of points in cells a and b
+            sizes = counts[a]*counts[b]
+            k = np.repeat(np.arange(len(a)),sizes)
+            r = np.arange(sizes.sum())-np.repeat(np.cumsum(sizes)-sizes,sizes)
+            width = counts[b][k]
+            i = order[starts[a][k]+r//width]
+            j = order[starts[b][k]+r%width]
+            dist = self.row_distance(i,j)
+            keep = dist<=eps
+            return i[keep],j[keep],dist[keep]
+
+        tasks = []
+        for offset in product((-1,0,1),repeat=dims):
+            target = unique+np.dot(offset,radix)
+            found = np.minimum(np.searchsorted(unique,target),len(unique)-1)
+            a = np.flatnonzero(unique[found]==target)
+            b = found[a]
+            # split the cells into blocks of limited numbers of pairs
+            bounds = np.searchsorted(np.cumsum(counts[a]*counts[b]),
+                                     np.arange(0,1+(counts[a]*counts[b]).sum(),
+                                               block_elements//(self.attr_size+4)))
+            bounds = np.unique(np.concatenate([bounds,[0,len(a)]]))
+            tasks.extend((a[start:stop],b[start:stop]) for start,stop in \
+                         zip(bounds[:-1],bounds[1:]) if stop>start)
+
+        results = parallel_map(lambda t: pairs(*t),tasks)
+        return tuple(np.concatenate([result[c] for result in results]) for c in range(3))
+
+    def neighbour_graph(self, c):
+        '''
+        Returns the edges (i,j) with i<j joining every point to its c
+        spatially nearest points (k-d tree of scipy on the grid coordinates
+        if available, blocked search of the location distances otherwise)
+        '''
+        n = len(self)
+        c = min(c,n-1)
+        location = ClusterArrays(self.keys,self.xy,self.attributes[:,:0],0,
+                                 self.manhattan,self.ellipsoid,self.geographic,self.geo)
+        if cKDTree is not None:
+            index = cKDTree(location.grid_coordinates()).query( \
+                    location.grid_coordinates(),c+1,p=1 if self.manhattan else 2)[1]
+        else:
+            index = location.k_nearest(location,c+1)[0]
+        i = np.repeat(np.arange(n),c+1)
+        j = index.reshape(-1)
+        codes = np.unique(np.minimum(i,j).astype(np.int64)*n+np.maximum(i,j))
+        codes = codes[codes//n!=codes%n]
+        return codes//n,codes%n
+
+    def condensed(self, out=None):
+        '''
+        Returns the pairwise distances of all points as condensed upper
+        triangle of length n(n-1)/2 stored row by row, row blocks are
+        computed by worker threads writing straight into out (which may
+        be a memory-mapped array)
+        '''
+        n = len(self)
+        if out is None:
+            out = np.empty(n*(n-1)//2)
+        def fill(start,stop):
+            dist = self.subset(np.arange(start,stop)).block_distance( \
+                   self.subset(np.arange(start,n)))
+            for i in range(start,stop):
+                offset = i*n-i*(i+1)//2
+                out[offset:offset+n-i-1] = dist[i-start,i-start+1:]
+        parallel_blocks(fill,n-1,self.block_size(n))
+        return out
+
+    def cdist(self, other, out=None):
+        '''
+        Returns the (n,m) matrix of distances to all m points of other,
+        row blocks are written straight into out (which may be a
+        memory-mapped array)
+        '''
+        if out is None:
+            out = np.empty((len(self),len(other)))
+        def fill(start,stop):
+            out[start:stop] = self.block_distance(other,slice(start,stop))
+        parallel_blocks(fill,len(self),self.block_size(len(other)))
+        return out
+
+    def nearest(self, other):
+        '''
+        Returns index of and distance to the closest point of other
+        for every row without holding the full distance matrix
+        '''
+        labels = np.empty(len(self),dtype=np.intp)
+        mindist = np.empty(len(self))
+        def fill(start,stop):
+            dist = self.block_distance(other,slice(start,stop))
+            labels[start:stop] = np.argmin(dist,axis=1)
+            mindist[start:stop] = dist[np.arange(stop-start),labels[start:stop]]
+        parallel_blocks(fill,len(self),self.block_size(len(other)))
+        return labels,mindist
+
+    def tree_coordinates(self):
+        '''
+        Returns coordinates and the order p of the Minkowski norm whose
+        distances never exceed the combined distance (equal for Manhattan
+        distances or pure location or attribute distances) or None for
+        distances on the ellipsoid
+        '''
+        w = 0.01*self.pa
+        scale = 2 if self.manhattan else 1
+        columns = []
+        if self.pa < 100:
+            if self.ellipsoid is not None:
+                return None
+            columns.append(scale*(1-w)*self.xy)
+        if self.pa > 0:
+            columns.append(scale*w*self.attributes)
+        return np.column_stack(columns),1 if self.manhattan else 2
+
+    def k_nearest(self, other, c):
+        '''
+        Returns indices of and distances to the c closest points of other
+        (sorted by distance) for every row, holding only (n,c) arrays
+        Candidates are looked up in a k-d tree of scipy if available
+        (planar or attribute distances), all points are compared otherwise
+        '''
+        index = np.empty((len(self),c),dtype=np.intp)
+        mindist = np.empty((len(self),c))
+        coords = self.tree_coordinates()
+        if cKDTree is not None and coords is not None and c<len(other):
+            coords,p = coords
+            tree = cKDTree(other.tree_coordinates()[0])
+            def fill(start,stop):
+                rows = np.arange(start,stop)
+                queried = min(2*c,len(other))
+                while len(rows):
+                    bound,found = tree.query(coords[rows],queried,p=p)
+                    bound = bound.reshape(len(rows),-1)
+                    found = found.reshape(len(rows),-1)
+                    dist = self.distance(self.xy[rows,None,:],None,self.attributes[rows,None,:],
+                                         other.xy[found],None,other.attributes[found])
+                    r = np.arange(len(rows))[:,None]
+                    order = np.argsort(dist,axis=1,kind='stable')[:,:c]
+                    index[rows] = found[r,order]
+                    mindist[rows] = dist[r,order]
+                    if queried == len(other):
+                        break
+                    # points beyond the queried ones may still be closer
+                    # while their lower bound stays below the c-th distance
+                    rows = rows[bound[:,-1]<mindist[rows,-1]]
+                    queried = min(2*queried,len(other))
+            parallel_blocks(fill,len(self),self.block_size(2*c))
+            return index,mindist
+        def fill(start,stop):
+            dist = self.block_distance(other,slice(start,stop))
+            rows = np.arange(stop-start)[:,None]
+            part = np.argpartition(dist,c-1,axis=1)[:,:c] if c<len(other) else \
+                   np.broadcast_to(np.arange(len(other)),dist.shape)
+            order = np.argsort(dist[rows,part],axis=1)
+            index[start:stop] = part[rows,order]
+            mindist[start:stop] = dist[rows,index[start:stop]]
+        parallel_blocks(fill,len(self),self.block_size(len(other)))
+        return index,mindist
+
+    def means(self, labels, k, weights=None):
+        '''
+        Returns the (weighted) mean centers of the points per cluster label
+        '''
+        if weights is None:
+            weights = np.ones(len(self))
+        total = np.bincount(labels,weights=weights,minlength=k)
+        columns = np.column_stack([self.xy,self.attributes])
+        sums = np.column_stack([np.bincount(labels,weights=weights*columns[:,j],
+                               minlength=k) for j in range(columns.shape[1])])
+        sums /= total[:,None]
+        return self.centers(sums[:,:2],sums[:,2:])
+
+    def groups(self, labels, k):
+        '''
+        Returns lists of point IDs per cluster label
+        '''
+        order = np.argsort(labels,kind='stable')
+        bounds = np.cumsum(np.bincount(labels,minlength=k))[:-1]
+        return [[self.keys[i] for i in rows] for rows in np.split(order,bounds)]
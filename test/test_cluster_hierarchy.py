@@ -0,0 +1,213 @@
+# coding=utf-8
+"""Tests for the agglomerative clustering engines.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'jjenkner@web.de'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..cluster_hierarchy import (condensed_index, cut_tree,
+                                 emst_available, emst_linkage, generic_linkage,
+                                 graph_linkage, linkage_pointer, linkage_update,
+                                 nn_chain, parse_cluster_numbers,
+                                 pointer_linkage, reducible, slink, square_file)
+
+
+def condensed_pair(n, position):
+    """Rows i < j of the distance at the given condensed position."""
+    i = int(n-2-np.floor(np.sqrt(-8*position+4*n*(n-1)-7)/2.0-0.5))
+    j = int(position+i+1-n*(n-1)//2+(n-i)*(n-i-1)//2)
+    return i, j
+
+
+def lance_williams(D, n, link, sizes=None, stop=1):
+    """Reference merge table from a scan for the closest pair before every
+    merge and Lance-Williams updates of the condensed distances D."""
+    sizes = np.ones(n) if sizes is None else np.array(sizes, dtype=float)
+    active = np.ones(n, dtype=bool)
+    merges = np.empty((max(n-stop, 0), 4))
+    for step in range(n-stop):
+        position = int(np.argmin(D))
+        i, j = condensed_pair(n, position)
+        height = D[position]
+        active[i] = active[j] = False
+        others = np.flatnonzero(active)
+        il = condensed_index(n, i, others)
+        jl = condensed_index(n, j, others)
+        D[il] = linkage_update(link, D[il], D[jl], height, sizes[i], sizes[j],
+                               sizes[others])
+        D[jl] = np.inf
+        D[position] = np.inf
+        active[i] = True
+        sizes[i] += sizes[j]
+        merges[step] = (i, j, height, sizes[i])
+    return merges
+
+
+def random_condensed(n=30, seed=1):
+    """Condensed Euclidean distances of normally distributed points."""
+    xy = np.random.default_rng(seed).normal(size=(n, 2))
+    i, j = np.triu_indices(n, 1)
+    return np.hypot(*(xy[i]-xy[j]).T)
+
+
+def same_partition(labels1, labels2):
+    """Whether two labelings group the points identically."""
+    return np.array_equal(labels1[:, None] == labels1[None, :],
+                          labels2[:, None] == labels2[None, :])
+
+
+class ClusterHierarchyTest(unittest.TestCase):
+    """Test the hierarchical clustering on condensed distances."""
+
+    def test_condensed_positions(self):
+        """Condensed positions and row pairs are inverse."""
+        n = 17
+        i, j = np.triu_indices(n, 1)
+        positions = condensed_index(n, j, i)
+        np.testing.assert_array_equal(positions, np.arange(len(i)))
+        for position in (0, 5, 100, len(i)-1):
+            self.assertEqual(condensed_pair(n, position), (i[position], j[position]))
+
+    def test_single_linkage(self):
+        """Single linkage heights are increasing and cut into k clusters."""
+        D = random_condensed()
+        merges = lance_williams(D.copy(), 30, "single")
+        self.assertTrue(np.all(np.diff(merges[:, 2]) >= 0))
+        self.assertAlmostEqual(merges[0, 2], D.min())
+        labels = cut_tree(30, merges, 4)
+        self.assertEqual(len(np.unique(labels)), 4)
+        # partial runs agree with the full tree
+        partial = lance_williams(D.copy(), 30, "single", stop=4)
+        self.assertTrue(same_partition(cut_tree(30, partial, 4), labels))
+
+    def test_nn_chain(self):
+        """The nearest-neighbor chain reproduces the generic dendrogram."""
+        D = random_condensed(40, seed=3)
+        sizes = np.random.default_rng(3).integers(1, 4, 40)
+        for link in reducible:
+            generic = lance_williams(D.copy(), 40, link, sizes)
+            chain = nn_chain(D.copy(), 40, link, sizes)
+            np.testing.assert_allclose(chain[:, 2], generic[:, 2])
+            np.testing.assert_allclose(chain[:, 3], generic[:, 3])
+            for k in (2, 5, 11):
+                self.assertTrue(same_partition(cut_tree(40, chain, k),
+                                               cut_tree(40, generic, k)))
+        with self.assertRaises(ValueError):
+            nn_chain(D.copy(), 40, "centroid")
+
+    def test_generic_linkage(self):
+        """The heap of neighbor candidates reproduces the pair scan."""
+        D = random_condensed(40, seed=5)
+        sizes = np.random.default_rng(5).integers(1, 4, 40)
+        for link in ("centroid", "median", "wards"):
+            generic = lance_williams(D.copy(), 40, link, sizes, stop=3)
+            heap = generic_linkage(D.copy(), 40, link, sizes, stop=3)
+            np.testing.assert_array_equal(heap, generic)
+
+    def test_square_file(self):
+        """A memory-mapped square matrix reproduces the condensed runs."""
+        D = random_condensed(40, seed=9)
+        sizes = np.random.default_rng(9).integers(1, 4, 40)
+        i, j = np.triu_indices(40, 1)
+        folder = tempfile.mkdtemp()
+        try:
+            for link in reducible+("centroid", "median"):
+                square, path = square_file(40, folder)
+                square[i, j] = square[j, i] = D
+                if link in reducible:
+                    expected = nn_chain(D.copy(), 40, link, sizes)
+                    merges = nn_chain(square, 40, link, sizes)
+                else:
+                    expected = generic_linkage(D.copy(), 40, link, sizes)
+                    merges = generic_linkage(square, 40, link, sizes)
+                del square
+                os.remove(path)
+                np.testing.assert_array_equal(merges, expected)
+        finally:
+            os.rmdir(folder)
+
+    @unittest.skipUnless(emst_available, "scipy not available")
+    def test_emst_linkage(self):
+        """The minimum spanning tree yields the single linkage dendrogram."""
+        xy = np.random.default_rng(7).normal(size=(60, 2))
+        xy = np.vstack([xy, xy[:5]])
+        i, j = np.triu_indices(65, 1)
+        chain = nn_chain(np.hypot(*(xy[i]-xy[j]).T), 65, "single")
+        tree = emst_linkage(xy)
+        np.testing.assert_allclose(tree[:, 2:], chain[:, 2:])
+        for k in (2, 6):
+            self.assertTrue(same_partition(cut_tree(65, tree, k),
+                                           cut_tree(65, chain, k)))
+
+    def test_slink(self):
+        """SLINK yields the single linkage dendrogram, also when resumed."""
+        D = random_condensed(50, seed=9)
+        def row(i):
+            return D[condensed_index(50, i, np.arange(i))]
+        Pi, Lambda = slink(row, 50)
+        tree = pointer_linkage(Pi, Lambda)
+        chain = nn_chain(D.copy(), 50, "single")
+        np.testing.assert_allclose(tree[:, 2:], chain[:, 2:])
+        self.assertTrue(same_partition(cut_tree(50, tree, 4),
+                                       cut_tree(50, chain, 4)))
+        first = slink(row, 20)
+        resumed = slink(row, 50, *first)
+        np.testing.assert_array_equal(resumed[0], Pi)
+        np.testing.assert_array_equal(resumed[1], Lambda)
+
+    def test_linkage_pointer(self):
+        """Merge tables convert back into the SLINK pointer representation."""
+        D = random_condensed(40, seed=13)
+        def row(i):
+            return D[condensed_index(40, i, np.arange(i))]
+        Pi, Lambda = slink(row, 40)
+        pointer = linkage_pointer(40, nn_chain(D.copy(), 40, "single"))
+        np.testing.assert_array_equal(pointer[0], Pi)
+        np.testing.assert_allclose(pointer[1], Lambda)
+        # new points are inserted into a converted tree
+        i, j = np.triu_indices(25, 1)
+        first = linkage_pointer(25, nn_chain(D[condensed_index(40, i, j)], 25, "single"))
+        resumed = slink(row, 40, *first)
+        np.testing.assert_array_equal(resumed[0], Pi)
+        np.testing.assert_allclose(resumed[1], Lambda)
+
+    def test_parse_cluster_numbers(self):
+        """Lists of cluster numbers are sorted and checked."""
+        self.assertEqual(parse_cluster_numbers("8, 3;5,,3"), [3, 5, 8])
+        self.assertEqual(parse_cluster_numbers(""), [])
+        for text in ("3,x", "1,4"):
+            with self.assertRaises(ValueError):
+                parse_cluster_numbers(text)
+
+    def test_graph_linkage(self):
+        """On a complete graph the constrained merges are unconstrained."""
+        D = random_condensed(25, seed=11)
+        i, j = np.triu_indices(25, 1)
+        for link in ("single", "average", "wards", "centroid"):
+            graph = graph_linkage(25, i, j, D, link)
+            generic = lance_williams(D.copy(), 25, link)
+            np.testing.assert_allclose(graph[:, 2:], generic[:, 2:])
+        # two separate chains are never merged
+        chain = np.arange(9)
+        merges = graph_linkage(10, np.delete(chain, 4), np.delete(chain, 4)+1,
+                               np.ones(8), "complete")
+        self.assertEqual(len(merges), 8)
+        labels = cut_tree(10, merges, 2)
+        np.testing.assert_array_equal(labels, [0]*5+[1]*5)
+
+
+if __name__ == '__main__':
+    unittest.main()
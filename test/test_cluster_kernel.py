@@ -0,0 +1,189 @@
+# coding=utf-8
+"""Tests for the vectorized distance kernel.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'jjenkner@web.de'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+import json
+import unittest
+
+from itertools import combinations
+
+import numpy as np
+
+from .. import cluster_kernel
+from ..cluster_kernel import (ClusterArrays, centroid_model, cluster_scores,
+                              connected_components, fasterpam, geodesic,
+                              model_labels, parallel_map, sampled_silhouette,
+                              worker_budget)
+
+
+def random_arrays(n=40, attr_size=2, pa=0, manhattan=False, seed=1):
+    """Columnar test points with normally distributed coordinates."""
+    rng = np.random.default_rng(seed)
+    return ClusterArrays(list(range(n)), rng.normal(size=(n, 2)),
+                         rng.normal(size=(n, attr_size)), pa, manhattan)
+
+
+class ClusterKernelTest(unittest.TestCase):
+    """Test the columnar distance computations."""
+
+    def test_planar_distances(self):
+        """Blended distances agree with a scalar reference."""
+        for manhattan in (False, True):
+            arrays = random_arrays(pa=30, manhattan=manhattan)
+            dist = arrays.cdist(arrays)
+            p, q = arrays.xy[3], arrays.xy[7]
+            a, b = arrays.attributes[3], arrays.attributes[7]
+            if manhattan:
+                expected = 0.7*2*np.abs(p-q).sum()+2*0.3*np.abs(a-b).sum()
+            else:
+                expected = 0.7*np.hypot(*(p-q))+0.3*np.sqrt(((a-b)**2).sum())
+            self.assertAlmostEqual(dist[3, 7], expected)
+            self.assertAlmostEqual(dist[7, 3], expected)
+            self.assertEqual(dist[5, 5], 0)
+
+    def test_nearest(self):
+        """Nearest centers agree with the full distance matrix."""
+        arrays = random_arrays(n=500)
+        centers = arrays.subset([1, 100, 200, 300])
+        labels, mindist = arrays.nearest(centers)
+        dist = arrays.cdist(centers)
+        np.testing.assert_array_equal(labels, dist.argmin(axis=1))
+        np.testing.assert_allclose(mindist, dist.min(axis=1))
+
+    def test_k_nearest(self):
+        """Closest centers agree with the full distance matrix."""
+        for pa, manhattan in ((0, False), (40, True), (40, False), (100, False)):
+            arrays = random_arrays(n=500, pa=pa, manhattan=manhattan)
+            centers = arrays.subset(np.arange(0, 500, 5))
+            index, mindist = arrays.k_nearest(centers, 4)
+            expected = np.sort(arrays.cdist(centers), axis=1)[:, :4]
+            np.testing.assert_allclose(mindist, expected)
+            np.testing.assert_allclose(
+                arrays.cdist(centers)[np.arange(500)[:, None], index], expected)
+
+    def test_grid_pairs(self):
+        """Grid neighbourhoods agree with the full distance matrix."""
+        for pa, manhattan in ((0, False), (40, True), (100, False)):
+            arrays = random_arrays(n=300, pa=pa, manhattan=manhattan)
+            i, j, dist = arrays.grid_pairs(0.5)
+            expected = np.argwhere(arrays.cdist(arrays) <= 0.5)
+            found = np.column_stack([i, j])
+            found = found[np.lexsort((j, i))]
+            np.testing.assert_array_equal(found, expected)
+
+    def test_worker_budget(self):
+        """Nested pools share the worker budget of the outer pool."""
+        cluster_kernel.number_workers = 8
+        try:
+            self.assertEqual(parallel_map(lambda item: worker_budget(),
+                                          range(3)), [2, 2, 2])
+            inner = parallel_map(lambda item: parallel_map(
+                lambda inner: worker_budget(), range(4)), range(4))
+            self.assertEqual(inner, [[1]*4]*4)
+            self.assertEqual(worker_budget(), 8)
+        finally:
+            cluster_kernel.number_workers = None
+
+    def test_fasterpam(self):
+        """FasterPAM ends in a local optimum of the brute-force swaps."""
+        rng = np.random.default_rng(4)
+        for n, k, weighted in ((15, 2, False), (30, 4, True), (60, 5, False)):
+            arrays = random_arrays(n=n, attr_size=0, seed=n)
+            D = arrays.cdist(arrays)
+            mass = rng.integers(1, 4, n).astype(float) if weighted else np.ones(n)
+            medoids, swaps, passes = fasterpam(
+                D, rng.choice(n, k, replace=False), mass)
+            self.assertEqual(len(set(medoids)), k)
+            cost = np.dot(mass, D[:, medoids].min(axis=1))
+            for i in range(k):
+                for x in np.setdiff1d(np.arange(n), medoids):
+                    swapped = medoids.copy()
+                    swapped[i] = x
+                    self.assertGreaterEqual(
+                        np.dot(mass, D[:, swapped].min(axis=1)), cost-1.e-9)
+        # well separated groups lead to the exhaustive optimum
+        xy = np.concatenate([rng.normal(size=(6, 2))+offset
+                             for offset in ((0, 0), (20, 0), (0, 20))])
+        D = np.hypot(*(xy[:, None, :]-xy[None, :, :]).T)
+        best = min(D[:, list(rows)].min(axis=1).sum()
+                   for rows in combinations(range(18), 3))
+        medoids = fasterpam(D, [0, 1, 2])[0]
+        self.assertAlmostEqual(D[:, medoids].min(axis=1).sum(), best)
+
+    def test_model_round_trip(self):
+        """A written model assigns the training points to their clusters."""
+        rng = np.random.default_rng(12)
+        raw = rng.normal(size=(200, 2))*[30., 2.]+[500., -7.]
+        attr_centers, standard_factor = raw.mean(axis=0), 0.25
+        for manhattan in (False, True):
+            arrays = ClusterArrays(list(range(200)), rng.normal(size=(200, 2)),
+                                   (raw-attr_centers)*standard_factor, 30,
+                                   manhattan)
+            labels = arrays.nearest(arrays.subset(range(4)))[0]
+            for i in range(10):
+                centers = arrays.means(labels, 4)
+                labels = arrays.nearest(centers)[0]
+            model = json.loads(json.dumps(centroid_model(
+                centers, ["a", "b"], attr_centers, standard_factor, 30,
+                manhattan)))
+            np.testing.assert_array_equal(
+                model_labels(model, arrays.keys, arrays.xy, raw), labels)
+
+    def test_connected_components(self):
+        """Components of a small graph."""
+        labels = connected_components(7, np.array([0, 2, 4, 5]),
+                                      np.array([1, 3, 5, 3]))
+        np.testing.assert_array_equal(labels, [0, 0, 1, 1, 1, 1, 2])
+
+    def test_cluster_scores(self):
+        """Scores of two clusters agree with their definitions."""
+        arrays = random_arrays(n=100, attr_size=0)
+        labels = (arrays.xy[:, 0] > 0).astype(np.intp)
+        sse, calinski_harabasz, silhouette = cluster_scores(arrays, labels, 2)
+        means = np.array([arrays.xy[labels == c].mean(axis=0) for c in (0, 1)])
+        dist = np.hypot(*(arrays.xy[:, None, :]-means[None, :, :]).T).T
+        own = dist[np.arange(100), labels]
+        other = dist[np.arange(100), 1-labels]
+        between = sum((labels == c).sum()*((means[c]-arrays.xy.mean(axis=0))**2).sum()
+                      for c in (0, 1))
+        self.assertAlmostEqual(sse, (own**2).sum())
+        self.assertAlmostEqual(calinski_harabasz, between/(sse/98))
+        self.assertAlmostEqual(silhouette, ((other-own)/np.maximum(own, other)).mean())
+
+    def test_silhouette(self):
+        """Silhouette of all points agrees with the full distance matrix."""
+        arrays = random_arrays(n=120, pa=20)
+        labels = (arrays.xy[:, 0] > 0).astype(np.intp)+ \
+                 2*(arrays.xy[:, 1] > 0).astype(np.intp)
+        dist = arrays.cdist(arrays)
+        expected = []
+        for i in range(120):
+            own = labels == labels[i]
+            own[i] = False
+            a = dist[i, own].mean()
+            b = min(dist[i, labels == c].mean() for c in range(4) if c != labels[i])
+            expected.append((b-a)/max(a, b))
+        self.assertAlmostEqual(sampled_silhouette(arrays, labels, 4, 120),
+                               np.mean(expected))
+
+    def test_geodesic(self):
+        """Ellipsoidal distance Berlin - Paris on WGS84."""
+        dist = geodesic(np.radians(13.405), np.radians(52.52),
+                        np.radians(2.3522), np.radians(48.8566),
+                        6378137.0, 1/298.257223563)
+        self.assertAlmostEqual(dist/1000, 879.699, places=2)
+        self.assertEqual(geodesic(0.1, 0.2, 0.1, 0.2, 6378137.0, 0.0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
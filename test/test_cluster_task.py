@@ -0,0 +1,238 @@
+# coding=utf-8
+"""Tests for the clustering task on columnar points.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'jjenkner@web.de'
+__date__ = '2021-12-28'
+__copyright__ = '(C) 2021 by Johannes Jenkner'
+
+import unittest
+
+import numpy as np
+
+from .. import ClusterPoints_algorithm
+from ..ClusterPoints_algorithm import ClusterTask
+from ..cluster_hierarchy import cut_tree, emst_available
+from ..cluster_kernel import ClusterArrays
+from .test_cluster_hierarchy import lance_williams
+
+
+def blob_arrays(n=300, blobs=4, attr_size=0, pa=0, manhattan=False, seed=1):
+    """Columnar test points scattered around random blob centers."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-10, 10, size=(blobs, 2))
+    xy = centers[rng.integers(blobs, size=n)]+rng.normal(size=(n, 2))
+    return ClusterArrays(list(range(n)), xy, rng.normal(size=(n, attr_size)),
+                         pa, manhattan)
+
+
+def same_partition(clusters1, clusters2):
+    """Whether two lists of clusters group the point IDs identically."""
+    return sorted(map(sorted, clusters1)) == sorted(map(sorted, clusters2))
+
+
+def make_task(description, arrays, k, link=None, **kwargs):
+    """Clustering task on prepared columnar points with planar distances."""
+    task = ClusterTask(description, link, {}, arrays.pa, k, None,
+                       arrays.manhattan, **kwargs)
+    task.arrays = arrays
+    return task
+
+
+class ClusterTaskTest(unittest.TestCase):
+    """Test the clustering algorithms of the task."""
+
+    def test_kmeans_plusplus(self):
+        """K-means++ draws with probabilities of the weighted D**2."""
+        arrays = ClusterArrays([0, 1, 2], np.array([[0., 0.], [1., 0.], [3., 0.]]),
+                               np.zeros((3, 0)))
+        task = make_task("K-Means clustering", arrays, 2)
+        rng = np.random.default_rng(7)
+        for weights, expected in ((None, 0.9), (np.array([1., 9., 1.]), 0.5)):
+            drawn = [task.init_kmeans_plusplus(rng, arrays, 2, weights, [0])[1]
+                     for i in range(4000)]
+            self.assertAlmostEqual(np.mean(np.array(drawn) == 2), expected,
+                                   delta=0.03)
+
+    def test_exhausted_budget(self):
+        """Seeding completes k centers once the time budget is exhausted."""
+        arrays = blob_arrays(n=300, blobs=5)
+        for init in ("k-means++", "k-means||"):
+            task = make_task("K-Means clustering", arrays, 5, init=init,
+                             deadline=0.0)
+            rows = task.init_centers(np.random.default_rng(1), arrays)
+            self.assertEqual(len(set(rows)), 5)
+            self.assertTrue(task.run())
+            self.assertEqual(len(task.clusters), 5)
+
+    def test_kmeans_parallel(self):
+        """K-means|| reduces its candidates to k distinct centers."""
+        arrays = blob_arrays(n=500, blobs=6)
+        task = make_task("K-Means clustering", arrays, 6, init="k-means||")
+        rows = task.init_kmeans_parallel(np.random.default_rng(3), arrays)
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(len(np.unique(arrays.xy[rows], axis=0)), 6)
+        again = task.init_kmeans_parallel(np.random.default_rng(3), arrays)
+        self.assertEqual(rows, again)
+
+    def test_kmeans_fit(self):
+        """Labels and inertia belong to the returned centers."""
+        arrays = blob_arrays(n=400, blobs=5)
+        for max_iter in (1, 2, 300):
+            task = make_task("K-Means clustering", arrays, 5, max_iter=max_iter)
+            task.fit_arrays, task.fit_weights = arrays, None
+            inertia, centers, labels, criterion = \
+                task.kmeans_fit(np.random.default_rng(2))
+            nearest, mindist = arrays.nearest(centers)
+            np.testing.assert_array_equal(labels, nearest)
+            self.assertAlmostEqual(inertia, (mindist**2).sum())
+
+    def test_restarts(self):
+        """A fixed seed reproduces the fit, more restarts never do worse."""
+        arrays = blob_arrays(n=600, blobs=8)
+        for coreset_size in (0, 200):
+            objectives, coresets = [], []
+            for n_init in (1, 1, 4):
+                task = make_task("K-Means clustering", arrays, 8, n_init=n_init,
+                                 seed=11, coreset_size=coreset_size)
+                self.assertTrue(task.run())
+                objectives.append(task.objective)
+                coresets.append(task.fit_arrays.keys)
+            self.assertEqual(objectives[0], objectives[1])
+            self.assertLessEqual(objectives[2], objectives[0])
+            # the coreset does not depend on the number of restarts
+            self.assertEqual(coresets[0], coresets[2])
+
+    def test_build_coreset(self):
+        """Coreset weights add up to all points and preserve the inertia."""
+        arrays = blob_arrays(n=2000, blobs=5, seed=4)
+        task = make_task("K-Means clustering", arrays, 5, coreset_size=300)
+        coreset, weights = task.build_coreset(np.random.default_rng(5))
+        self.assertLessEqual(len(coreset), 300)
+        self.assertAlmostEqual(weights.sum(), 2000)
+        centers = arrays.subset([0, 1, 2, 3, 4])
+        full = (arrays.nearest(centers)[1]**2).sum()
+        approximation = np.dot(weights, coreset.nearest(centers)[1]**2)
+        self.assertLess(abs(approximation/full-1), 0.2)
+
+    def test_fuzzy_cmeans(self):
+        """Memberships follow the dense definition and sum to one."""
+        arrays = blob_arrays(n=400, blobs=5, attr_size=1, pa=20)
+        for neighbours, max_iter in ((0, 3), (0, 300), (5, 300), (2, 300)):
+            task = make_task("Fuzzy C-Means clustering", arrays, 5, seed=3,
+                             neighbours=neighbours, max_iter=max_iter)
+            self.assertTrue(task.run())
+            u = np.column_stack([task.full_memberships(p) for p in range(400)])
+            np.testing.assert_allclose(u.sum(axis=0), 1)
+            if neighbours in (0, 5):
+                # without truncation all clusters share the membership
+                distance = arrays.cdist(task.centers).T
+                expected = distance**-2/(distance**-2).sum(axis=0)
+                np.testing.assert_allclose(u, expected)
+            else:
+                self.assertTrue(np.all((u > 0).sum(axis=0) <= 2))
+
+    def test_cut_split_tree(self):
+        """Cuts of the split tree reproduce Bisecting K-means for k'."""
+        arrays = blob_arrays(n=500, blobs=8, seed=6)
+        runs = {}
+        for k in (3, 6, 9):
+            runs[k] = make_task("Bisecting K-Means clustering", arrays, k,
+                                seed=2, n_init=2)
+            self.assertTrue(runs[k].run())
+        task = make_task("Bisecting K-Means clustering", arrays, 6,
+                         seed=2, n_init=2)
+        task.cuts = [3, 9]
+        self.assertTrue(task.run())
+        self.assertEqual([sorted(cluster) for cluster in task.clusters],
+                         [sorted(cluster) for cluster in runs[6].clusters])
+        for k in (3, 6, 9):
+            self.assertTrue(same_partition(task.cut_split_tree(k),
+                                           runs[k].clusters))
+            self.assertTrue(same_partition(runs[9].cut_split_tree(k),
+                                           runs[k].clusters))
+
+    def test_kmedoids_clara(self):
+        """CLARA samples find medoids close to those of all points."""
+        arrays = blob_arrays(n=400, blobs=5, seed=8)
+        full = make_task("K-Medoids clustering", arrays, 5, seed=4)
+        self.assertTrue(full.run())
+        sampled = make_task("K-Medoids clustering", arrays, 5, seed=4,
+                            sample_size=60)
+        self.assertTrue(sampled.run())
+        self.assertEqual(sampled.medoid_sample_size(400), 60)
+        self.assertAlmostEqual(sampled.objective,
+                               arrays.nearest(sampled.centers)[1].sum())
+        self.assertLess(sampled.objective, 1.05*full.objective)
+        # too many points for the dense dissimilarities fall back to samples
+        limit = ClusterPoints_algorithm.number_dense_medoid_points
+        ClusterPoints_algorithm.number_dense_medoid_points = 100
+        try:
+            task = make_task("K-Medoids clustering", arrays, 5, seed=4)
+            self.assertEqual(task.medoid_sample_size(400), 100)
+            self.assertTrue(task.run())
+            self.assertLess(task.objective, 1.05*full.objective)
+        finally:
+            ClusterPoints_algorithm.number_dense_medoid_points = limit
+
+    @unittest.skipUnless(emst_available, "requires scipy")
+    def test_single_linkage(self):
+        """Single linkage skips cluster features and matches the exact scan."""
+        arrays = blob_arrays(n=200, blobs=4, seed=5)
+        task = make_task("Hierarchical clustering using Lance-Williams "+
+                         "distance updates", arrays, 4, link="single")
+        self.assertEqual(task.aggregation(5), 0)
+        self.assertTrue(task.run())
+        merges = lance_williams(arrays.condensed(), 200, "single")
+        labels = cut_tree(200, merges, 4)
+        clusters = [list(np.flatnonzero(labels == label))
+                    for label in np.unique(labels)]
+        self.assertTrue(same_partition(task.clusters, clusters))
+        # attributes, connectivity or other linkages keep the preprocessing
+        self.assertEqual(make_task(task.description(), blob_arrays(attr_size=1, pa=20),
+                                   4, link="single").aggregation(5), 5)
+        self.assertEqual(make_task(task.description(), arrays, 4,
+                                   link="average").aggregation(5), 5)
+        task.connectivity = 10
+        self.assertEqual(task.aggregation(5), 5)
+
+    def test_dbscan(self):
+        """Core, border and noise points agree with a brute-force search."""
+        arrays = blob_arrays(n=300, blobs=4, seed=9)
+        rng = np.random.default_rng(9)
+        arrays = ClusterArrays(list(range(360)), np.vstack([
+            arrays.xy, rng.uniform(-14, 14, size=(60, 2))]), np.zeros((360, 0)))
+        task = make_task("DBSCAN clustering", arrays, 2, eps=0.6, min_points=6)
+        self.assertTrue(task.run())
+        D = arrays.cdist(arrays)
+        near = D <= 0.6
+        core = near.sum(axis=1) >= 6
+        expected = np.full(360, -1)
+        for start in np.flatnonzero(core):
+            if expected[start] >= 0:
+                continue
+            expected[start] = start
+            stack = [start]
+            while stack:
+                for other in np.flatnonzero(near[stack.pop()] & core):
+                    if expected[other] < 0:
+                        expected[other] = start
+                        stack.append(other)
+        for row in np.flatnonzero(~core & (near & core).any(axis=1)):
+            cores = np.flatnonzero(near[row] & core)
+            expected[row] = expected[cores[np.argmin(D[row, cores])]]
+        clusters = [list(np.flatnonzero(expected == label))
+                    for label in np.unique(expected[expected >= 0])]
+        self.assertTrue(same_partition(task.clusters, clusters))
+        self.assertEqual(sorted(task.noise), list(np.flatnonzero(expected < 0)))
+        self.assertGreater(len(task.noise), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()